@@ -0,0 +1,200 @@
+"""Streaming anomaly detection on the live meter readings.
+
+Every meter keeps a fixed amount of state: an exponentially weighted mean
+and variance, an hour-of-day baseline (24 weighted means) and the time its
+reading last changed. An update folds the new readings of all meters into
+that state with a handful of numpy operations, so its cost grows with the
+number of meters but never with the history, and nothing is rescanned.
+
+Checks per reading:
+
+- spike: the reading is more than `z_threshold` standard deviations away
+  from its expected value, the hour-of-day baseline once that hour has
+  enough samples, the overall mean before
+- flatline: the reading hasn't changed for `flatline_seconds`
+
+Events go to a bounded log; the tiles ask `flags()` which meters are
+currently anomalous.
+"""
+import collections
+import os
+import threading
+import time
+from typing import Deque, Dict, List, Mapping, NamedTuple, Optional
+
+import numpy as np
+import streamlit as st
+from prometheus_client import Counter
+
+from live_updates import ReadingsHub
+
+# Weight of a new reading in the running mean/variance (~1/alpha readings of memory)
+EWMA_ALPHA = float(os.environ.get('ENERGYBOARD_ANOMALY_ALPHA', 0.05))
+# Weight of a new reading in the baseline of its hour of day
+SEASONAL_ALPHA = float(os.environ.get('ENERGYBOARD_ANOMALY_SEASONAL_ALPHA', 0.01))
+Z_THRESHOLD = float(os.environ.get('ENERGYBOARD_ANOMALY_Z', 4))
+FLATLINE_SECONDS = float(os.environ.get('ENERGYBOARD_ANOMALY_FLATLINE_SECONDS', 300))
+# Readings a meter (or an hour of its baseline) needs before it is checked
+WARMUP = int(os.environ.get('ENERGYBOARD_ANOMALY_WARMUP', 30))
+LOG_SIZE = int(os.environ.get('ENERGYBOARD_ANOMALY_LOG_SIZE', 1000))
+
+ANOMALIES = Counter('energyboard_anomalies_total', 'Anomalies found in the live readings', ['kind'])
+
+
+class AnomalyEvent(NamedTuple):
+    time: float  # Unix time of the reading
+    meter: str
+    kind: str  # 'spike' or 'flatline'
+    value: float
+    expected: float
+    score: float  # Standard deviations for spikes, seconds unchanged for flatlines
+
+
+class AnomalyDetector:
+    """Running statistics of any number of meters, updated in place"""
+
+    # Per-meter arrays: name, initial value, dtype, shape after the meter axis
+    _STATE = (
+        ('count', 0, np.int64, ()),
+        ('mean', 0.0, float, ()),
+        ('var', 0.0, float, ()),
+        ('last_value', np.nan, float, ()),
+        ('last_change', np.nan, float, ()),  # Unix time
+        ('seasonal_mean', 0.0, float, (24,)),
+        ('seasonal_count', 0, np.int64, (24,)),
+        ('spiking', False, bool, ()),
+        ('flat', False, bool, ()),
+    )
+
+    def __init__(self, alpha: float = EWMA_ALPHA, seasonal_alpha: float = SEASONAL_ALPHA,
+                 z_threshold: float = Z_THRESHOLD, flatline_seconds: float = FLATLINE_SECONDS,
+                 warmup: int = WARMUP, log_size: int = LOG_SIZE):
+        self.alpha = alpha
+        self.seasonal_alpha = seasonal_alpha
+        self.z_threshold = z_threshold
+        self.flatline_seconds = flatline_seconds
+        self.warmup = warmup
+        self.events: Deque[AnomalyEvent] = collections.deque(maxlen=log_size)
+
+        self.meters: List[str] = []
+        self._slots: Dict[str, int] = {}
+        # Slots of the last readings' keys, reused while the meters stay the same
+        self._last_keys = None
+        self._last_index = None
+        self._lock = threading.Lock()
+        for name, fill, dtype, shape in self._STATE:
+            setattr(self, name, np.full((0,) + shape, fill, dtype=dtype))
+
+    def _grow(self, size: int):
+        """Grow the per-meter arrays to `size` slots, keeping their contents"""
+        for name, fill, dtype, shape in self._STATE:
+            old = getattr(self, name)
+            grown = np.full((size,) + shape, fill, dtype=dtype)
+            grown[:len(old)] = old
+            setattr(self, name, grown)
+
+    def _index(self, keys: tuple) -> np.ndarray:
+        if keys == self._last_keys:
+            return self._last_index
+        new = [meter for meter in keys if meter not in self._slots]
+        if new:
+            for meter in new:
+                self._slots[meter] = len(self.meters)
+                self.meters.append(meter)
+            if len(self.meters) > len(self.mean):
+                self._grow(max(len(self.meters), 2 * len(self.mean), 16))
+        self._last_keys = keys
+        self._last_index = np.fromiter((self._slots[meter] for meter in keys), dtype=np.intp, count=len(keys))
+        return self._last_index
+
+    def update(self, readings: Mapping[str, float], now: Optional[float] = None) -> List[AnomalyEvent]:
+        """Fold in one reading per meter and return the anomalies it started"""
+        now = time.time() if now is None else now
+        hour = time.localtime(now).tm_hour
+        with self._lock:
+            index = self._index(tuple(readings))
+            values = np.fromiter(readings.values(), dtype=float, count=len(index))
+            valid = ~np.isnan(values)
+            index, values = index[valid], values[valid]
+
+            # Expected value: the baseline of this hour once it has enough samples
+            mean, std = self.mean[index], np.sqrt(self.var[index])
+            seasonal = self.seasonal_count[index, hour] >= self.warmup
+            expected = np.where(seasonal, self.seasonal_mean[index, hour], mean)
+            deviation = np.abs(values - expected)
+            checked = (self.count[index] >= self.warmup) & (std > 0)
+            score = np.divide(deviation, std, out=np.zeros(len(index)), where=checked)
+            spiking = checked & (score > self.z_threshold)
+
+            # Unchanged readings keep the time of their last change
+            changed = values != self.last_value[index]
+            last_change = np.where(changed | np.isnan(self.last_change[index]), now, self.last_change[index])
+            unchanged_for = now - last_change
+            flat = unchanged_for >= self.flatline_seconds
+
+            # Only changes of state are logged, not every reading of a long anomaly
+            events = self._events(now, index, values, expected, score, spiking & ~self.spiking[index], 'spike')
+            events += self._events(now, index, values, values, unchanged_for, flat & ~self.flat[index], 'flatline')
+            self.spiking[index] = spiking
+            self.flat[index] = flat
+            self.last_value[index] = values
+            self.last_change[index] = last_change
+
+            # West's weighted mean/variance. Spikes are clipped to the threshold
+            # first, so one outlier barely moves the statistics but a lasting
+            # change of level is learned over time
+            limit = self.z_threshold * std
+            values = np.where(spiking, np.clip(values, expected - limit, expected + limit), values)
+            diff = values - self.mean[index]
+            first = self.count[index] == 0
+            increment = np.where(first, diff, self.alpha * diff)
+            self.mean[index] += increment
+            # A meter's first reading is its mean, with no spread yet
+            self.var[index] = np.where(first, 0.0, (1 - self.alpha) * (self.var[index] + diff * increment))
+            self.count[index] += 1
+            seasonal_count = self.seasonal_count[index, hour]
+            self.seasonal_mean[index, hour] += np.where(
+                seasonal_count == 0, 1.0, self.seasonal_alpha
+            ) * (values - self.seasonal_mean[index, hour])
+            self.seasonal_count[index, hour] = seasonal_count + 1
+
+            self.events.extend(events)
+        for event in events:
+            ANOMALIES.labels(kind=event.kind).inc()
+        return events
+
+    def _events(self, now, index, values, expected, score, started, kind) -> List[AnomalyEvent]:
+        return [
+            AnomalyEvent(now, self.meters[index[i]], kind, float(values[i]), float(expected[i]), float(score[i]))
+            for i in np.flatnonzero(started)
+        ]
+
+    def flags(self, now: Optional[float] = None) -> Dict[str, str]:
+        """{meter: 'spike' or 'flatline'} of the meters that are anomalous right now.
+
+        Flatlines are judged by the time, so meters that stopped sending
+        altogether are flagged too.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            size = len(self.meters)
+            flat = (now - self.last_change[:size]) >= self.flatline_seconds
+            spiking = self.spiking[:size]
+            return {
+                self.meters[i]: 'spike' if spiking[i] else 'flatline'
+                for i in np.flatnonzero(spiking | flat)
+            }
+
+    def recent_events(self, limit: int = 50) -> List[AnomalyEvent]:
+        """The newest `limit` events, newest first"""
+        with self._lock:
+            events = list(self.events)
+        return events[::-1][:limit]
+
+
+@st.cache_resource
+def get_anomaly_detector(_hub: ReadingsHub) -> AnomalyDetector:
+    """The detector of the process, fed by every poll of the hub, repeated readings included"""
+    detector = AnomalyDetector()
+    _hub.subscribe(lambda version, readings: detector.update(readings), every_poll=True)
+    return detector
@@ -0,0 +1,207 @@
+"""Benchmark of the dashboard's data loading and rerun latency versus data size.
+
+Generates E_H.xlsx/E_P.xlsx-shaped workbooks with 1k to 1M readings per
+meter (synthetic_data.py) and measures, each size in its own fresh process:
+
+- load_excel_data and load_rollups cold (no Parquet copy and no SQLite
+  store yet), warm (unchanged workbooks) and after a restart (Parquet
+  copy and store present, empty process caches)
+- a first run and reruns of Energyboard.py through Streamlit's AppTest
+- peak Python allocations (tracemalloc) and the process' max RSS
+
+Results are written as JSON so runs of different commits can be compared:
+
+    python benchmarks/bench_dashboard.py --sizes 1000,10000 --output bench_output.json
+
+Everything runs offline; the generated workbooks are kept in --workdir and
+reused by later runs. Each size has its own sites.toml there, which its
+child process reads through ENERGYBOARD_SITES, and its own SQLite store
+and Parquet copies, so the repository's workbooks and caches are left alone.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+
+
+def prepare_workdir(workdir, rows):
+    """Directory with both workbooks for `rows` readings and their sites.toml, generated once"""
+    from excel_reader import METER_COLUMNS
+    from synthetic_data import DEFAULT_METERS, SeriesGenerator, write_workbooks
+
+    directory = os.path.join(workdir, f'rows-{rows}')
+    # Written after the workbooks, so it marks a complete directory
+    if os.path.exists(os.path.join(directory, 'sites.toml')):
+        return directory
+
+    meters = [meter for meter in DEFAULT_METERS if meter.name in METER_COLUMNS]
+    write_workbooks(directory, SeriesGenerator(meters, periods=rows).chunks())
+    return directory
+
+
+def child_environment(directory) -> dict:
+    """Environment of the child measuring the size in `directory`: its registry and store"""
+    directory = os.path.abspath(directory)
+    return {
+        **os.environ,
+        'ENERGYBOARD_SITES': os.path.join(directory, 'sites.toml'),
+        'ENERGYBOARD_STORAGE': os.path.join(directory, '.cache', 'energyboard.sqlite'),
+    }
+
+
+def timed(func) -> float:
+    """Seconds taken by one call"""
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def peak_allocations(func) -> int:
+    """Peak bytes allocated by Python during one call.
+
+    Measured in a separate call because tracing slows the parsing down a lot.
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def reset_process_caches(persistent=False):
+    """Forget everything a restarted server wouldn't know.
+
+    persistent: also delete what a restart keeps, the Parquet copies and
+    the SQLite store, so the workbooks are parsed and imported again.
+    """
+    import excel_reader
+    import rollups
+    import storage
+
+    excel_reader._tail_readers.clear()
+    excel_reader._hash_memo.clear()
+    rollups._cache.update(key=None, rollups=None)
+    storage.get_storage.cache_clear()
+    if persistent:
+        shutil.rmtree(excel_reader.CACHE_DIR, ignore_errors=True)
+        if storage.STORAGE != 'snowflake':
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(storage.STORAGE + suffix):
+                    os.remove(storage.STORAGE + suffix)
+
+
+def run_child(rows, directory, reruns):
+    """Measurements for one size; runs in its own process, started with child_environment()"""
+    import excel_reader
+    import rollups
+
+    if any(os.path.dirname(path) != os.path.abspath(directory) for path in excel_reader.EXCEL_PATHS.values()):
+        raise RuntimeError(f"ENERGYBOARD_SITES doesn't point at the workbooks in {directory}")
+    # Parquet copies next to the size's workbooks, not in the repository's cache
+    excel_reader.CACHE_DIR = os.path.join(directory, '.cache', 'workbooks')
+
+    result = {'rows': rows}
+    reset_process_caches(persistent=True)
+    result['load_excel_data_cold_s'] = timed(excel_reader.load_excel_data)
+    result['load_excel_data_warm_s'] = timed(excel_reader.load_excel_data)
+    reset_process_caches()
+    result['load_excel_data_restart_s'] = timed(excel_reader.load_excel_data)
+    reset_process_caches(persistent=True)
+    result['load_excel_data_cold_peak_bytes'] = peak_allocations(excel_reader.load_excel_data)
+
+    reset_process_caches(persistent=True)
+    result['load_rollups_cold_s'] = timed(rollups.load_rollups)
+    result['load_rollups_warm_s'] = timed(rollups.load_rollups)
+    reset_process_caches()
+    result['load_rollups_restart_s'] = timed(rollups.load_rollups)
+    reset_process_caches(persistent=True)
+    result['load_rollups_cold_peak_bytes'] = peak_allocations(rollups.load_rollups)
+
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(os.path.join(REPO_ROOT, 'Energyboard.py'), default_timeout=600)
+    started = time.perf_counter()
+    app.run()
+    result['script_first_run_s'] = time.perf_counter() - started
+    result['script_exceptions'] = [e.message for e in app.exception]
+
+    rerun_times = []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        app.run()
+        rerun_times.append(time.perf_counter() - started)
+    result['script_rerun_median_s'] = statistics.median(rerun_times)
+    result['script_rerun_max_s'] = max(rerun_times)
+
+    # ru_maxrss is in KiB on Linux
+    result['max_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='comma separated numbers of readings per meter')
+    parser.add_argument('--reruns', type=int, default=5, help='script reruns to time per size')
+    parser.add_argument('--workdir', default=os.path.join(REPO_ROOT, '.cache', 'bench'),
+                        help='where generated workbooks are kept')
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        directory = prepare_workdir(args.workdir, args.child)
+        print(json.dumps(run_child(args.child, directory, args.reruns)))
+        return
+
+    results = []
+    for rows in (int(size) for size in args.sizes.split(',')):
+        print(f"{rows} rows ...", file=sys.stderr)
+        directory = prepare_workdir(args.workdir, rows)
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--child', str(rows),
+             '--reruns', str(args.reruns), '--workdir', args.workdir],
+            text=True, env=child_environment(directory)
+        )
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    import pandas as pd
+    import streamlit
+
+    report = {
+        'commit': git_commit(),
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'pandas': pd.__version__,
+        'streamlit': streamlit.__version__,
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Benchmark of the energy_data transport: JSON records versus Arrow IPC.
+
+Serves a generated db.json (synthetic_data.py) with the mock API and
+compares, per response size, the bytes on the wire, the time to decode a
+response into a DataFrame and the memory the decoding allocates:
+
+    python benchmarks/bench_transport.py --sizes 10000,1000000 --output transport.json
+
+Decode time and memory are measured on the downloaded body, so they don't
+include the server or the network.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+
+
+def prepare_db(workdir, rows):
+    """db.json with `rows` readings of the API meters, generated once"""
+    from synthetic_data import DEFAULT_METERS, SeriesGenerator, write_energy_data_json
+
+    path = os.path.join(workdir, f'db-{rows}.json')
+    if not os.path.exists(path):
+        os.makedirs(workdir, exist_ok=True)
+        meters = [meter for meter in DEFAULT_METERS if meter.name.startswith('Hallo')]
+        write_energy_data_json(path + '.tmp', SeriesGenerator(meters, periods=rows).chunks())
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def measure(decode, body, repeat):
+    """(best seconds, peak bytes allocated by Python and Arrow) of decode(body)"""
+    import pyarrow as pa
+
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        decode(body)
+        seconds.append(time.perf_counter() - started)
+
+    arrow_before = pa.total_allocated_bytes()
+    tracemalloc.start()
+    try:
+        frame = decode(body)
+        python_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    arrow_bytes = pa.total_allocated_bytes() - arrow_before
+    del frame
+    return min(seconds), python_peak + arrow_bytes
+
+
+def decode_json(body):
+    import pandas as pd
+
+    frame = pd.DataFrame(json.loads(body))
+    frame['timestamp'] = pd.to_datetime(frame['timestamp'])
+    return frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='comma separated numbers of readings')
+    parser.add_argument('--repeat', type=int, default=3, help='decodes to time per size and format')
+    parser.add_argument('--workdir', default=os.path.join(REPO_ROOT, '.cache', 'bench'),
+                        help='where generated db.json files are kept')
+    parser.add_argument('--output', default='transport_output.json')
+    args = parser.parse_args()
+
+    import requests
+
+    from energy_api import ARROW_STREAM, arrow_to_frame
+    from mock_api import MockServer
+
+    results = []
+    for rows in (int(size) for size in args.sizes.split(',')):
+        print(f"{rows} rows ...", file=sys.stderr)
+        server = MockServer(prepare_db(args.workdir, rows), port=0).start()
+        try:
+            json_body = requests.get(f'{server.url}/energy_data').content
+            arrow_body = requests.get(f'{server.url}/energy_data', headers={'Accept': ARROW_STREAM}).content
+        finally:
+            server.stop()
+
+        json_seconds, json_bytes = measure(decode_json, json_body, args.repeat)
+        arrow_seconds, arrow_bytes = measure(arrow_to_frame, arrow_body, args.repeat)
+        results.append({
+            'rows': rows,
+            'json_body_bytes': len(json_body),
+            'arrow_body_bytes': len(arrow_body),
+            'json_decode_s': json_seconds,
+            'arrow_decode_s': arrow_seconds,
+            'json_decode_peak_bytes': json_bytes,
+            'arrow_decode_peak_bytes': arrow_bytes,
+            'decode_speedup': json_seconds / arrow_seconds,
+            'decode_memory_ratio': json_bytes / max(arrow_bytes, 1)
+        })
+        print(json.dumps(results[-1]), file=sys.stderr)
+
+    with open(args.output, 'w') as f:
+        json.dump({'results': results}, f, indent=2)
+    print(f"Wrote {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""Import-time report of the dashboard pages.
+
+Runs the module-level imports of each page in a fresh interpreter with
+`python -X importtime` and reports, per page, the total time and the
+modules that took longest (cumulative, i.e. including what they import).
+Imports inside functions are left out on purpose: they happen when their
+section is drawn, not before the first paint.
+
+Streamlit itself is imported first and not counted, a server process has
+loaded it before any page runs (--include-streamlit counts it).
+
+    python benchmarks/import_report.py --output import_output.json
+
+The JSON can be compared across commits to track the cold start.
+"""
+import argparse
+import ast
+import datetime
+import glob
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+from typing import Dict, List, NamedTuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# "import time:       123 |        456 |   numpy.core"
+LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+class ImportTime(NamedTuple):
+    module: str
+    depth: int  # 0 for modules the page imports itself
+    self_us: int
+    cumulative_us: int
+
+
+def page_imports(path: str) -> List[str]:
+    """The module-level import statements of a script, as source lines"""
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+
+    statements = []
+    nodes = list(tree.body)
+    while nodes:
+        node = nodes.pop(0)
+        if isinstance(node, (ast.Import, ast.ImportFrom)) and getattr(node, 'level', 0) == 0:
+            names = ', '.join(alias.name + (f" as {alias.asname}" if alias.asname else '') for alias in node.names)
+            if isinstance(node, ast.Import):
+                statements.append(f"import {names}")
+            else:
+                statements.append(f"from {node.module} import {names}")
+        elif isinstance(node, (ast.Try, ast.If)):
+            # try/except ImportError and the like: take the first branch
+            nodes[0:0] = node.body
+    return statements
+
+
+def parse_importtime(stderr: str, skip_streamlit: bool) -> List[ImportTime]:
+    times = []
+    for line in stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            times.append(ImportTime(module, (len(indent) - 1) // 2, int(self_us), int(cumulative_us)))
+    if skip_streamlit:
+        # Everything up to the top-level streamlit entry was the preload
+        for i, entry in enumerate(times):
+            if entry.depth == 0 and entry.module == 'streamlit':
+                return times[i + 1:]
+    return times
+
+
+def measure(path: str, include_streamlit: bool) -> List[ImportTime]:
+    code = '\n'.join(([] if include_streamlit else ['import streamlit']) + page_imports(path))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=REPO_ROOT, capture_output=True, text=True, env={**os.environ, 'PYTHONPATH': REPO_ROOT}
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing the modules of {path} failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr, not include_streamlit)
+
+
+def best_of(runs: List[List[ImportTime]]) -> Dict[str, ImportTime]:
+    """Fastest time of each module over the runs, to smooth out noise"""
+    best = {}
+    for run in runs:
+        for entry in run:
+            if entry.module not in best or entry.cumulative_us < best[entry.module].cumulative_us:
+                best[entry.module] = entry
+    return best
+
+
+def page_report(path: str, repeat: int, include_streamlit: bool, top: int) -> dict:
+    times = best_of([measure(path, include_streamlit) for _ in range(repeat)])
+    top_level = [entry for entry in times.values() if entry.depth == 0]
+    # Self time summed per top-level package: who pays for the imports
+    packages = {}
+    for entry in times.values():
+        package = entry.module.split('.')[0]
+        packages[package] = packages.get(package, 0) + entry.self_us
+    return {
+        'page': os.path.relpath(path, REPO_ROOT),
+        'total_ms': round(sum(entry.cumulative_us for entry in top_level) / 1000, 1),
+        'modules': len(times),
+        'imports': [
+            {'module': entry.module, 'cumulative_ms': round(entry.cumulative_us / 1000, 1)}
+            for entry in sorted(top_level, key=lambda entry: -entry.cumulative_us)
+        ],
+        'packages': [
+            {'package': package, 'self_ms': round(self_us / 1000, 1)}
+            for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('pages', nargs='*', help='scripts to measure, default Energyboard.py and pages/*.py')
+    parser.add_argument('--repeat', type=int, default=3, help='fresh interpreters per page, the fastest counts')
+    parser.add_argument('--top', type=int, default=10, help='packages listed per page')
+    parser.add_argument('--include-streamlit', action='store_true', help='count the import of streamlit too')
+    parser.add_argument('--output', help='also write the report as JSON')
+    args = parser.parse_args()
+
+    pages = args.pages or [os.path.join(REPO_ROOT, 'Energyboard.py'),
+                           *sorted(glob.glob(os.path.join(REPO_ROOT, 'pages', '*.py')))]
+    reports = [page_report(page, args.repeat, args.include_streamlit, args.top) for page in pages]
+
+    for report in reports:
+        print(f"{report['page']}: {report['total_ms']} ms, {report['modules']} modules")
+        for entry in report['imports']:
+            print(f"    {entry['cumulative_ms']:8.1f} ms  {entry['module']}")
+        print("  by package (self time):")
+        for entry in report['packages']:
+            print(f"    {entry['self_ms']:8.1f} ms  {entry['package']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'include_streamlit': args.include_streamlit,
+                'pages': reports,
+            }, f, indent=2)
+        print(f"Wrote {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,397 @@
+"""Load test of the dashboard pages with many concurrent sessions.
+
+Starts the app with `streamlit run` (headless, on a free local port) and
+simulates N users at once over Streamlit's own websocket protocol, the
+way browsers talk to it. Every user opens a page, then repeatedly clicks
+one of the site buttons, drags the time slider to a random period or hits
+'Refresh Data' (where the page has it), with a short think time between
+actions. Like a browser, each user also keeps the page's timed fragments
+running (st.fragment(run_every=...)) for as long as it stays.
+
+Every rerun is timed from the request to the server's 'script finished'.
+For each number of users the report gives the p50/p95/p99 latency (also
+per page and per action), the errors, and the CPU (in cores) and peak
+resident memory of the server process:
+
+    python benchmarks/loadtest_sessions.py --sessions 1,8,32,64 --output loadtest_output.json
+
+The pages' API calls go to mock_api.py, started on another free local
+port, so nothing leaves the machine. Server CPU and memory are read from
+/proc and are only reported on Linux.
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from tornado.websocket import websocket_connect
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+DEFAULT_SESSIONS = (1, 2, 4, 8, 16, 32)
+# Main script and the pages, by the name Streamlit gives them
+DEFAULT_PAGES = ('', 'test')
+MAIN_SCRIPT = 'Energyboard.py'
+SLIDER_START = datetime.datetime(2023, 1, 1)
+SLIDER_DAYS = 730
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class Step(NamedTuple):
+    page: str
+    action: str
+    seconds: float
+    error: str  # '' when the rerun succeeded
+
+
+class Widget(NamedTuple):
+    kind: str  # 'button' or 'slider'
+    id: str
+    label: str
+    fragment_id: str  # '' outside fragments
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Session:
+    """One simulated browser tab"""
+
+    def __init__(self, url: str, page: str, timeout: float):
+        self.url = url
+        self.page = page
+        self.timeout = timeout
+        self.widgets: Dict[str, Widget] = {}
+        self.values: Dict[str, WidgetState] = {}  # Non-trigger widget values sent with every rerun
+        self.fragments: Dict[str, float] = {}  # fragment id -> run_every interval
+        self._connection = None
+        self._reader = None
+        self._finished: Optional[asyncio.Future] = None
+        self._errors: List[str] = []
+        # A tab has at most one rerun in flight
+        self._busy = asyncio.Lock()
+
+    async def connect(self):
+        self._connection = await websocket_connect(self.url, subprotocols=['streamlit'])
+        self._reader = asyncio.ensure_future(self._read())
+
+    async def close(self):
+        if self._connection is not None:
+            self._connection.close()
+        if self._reader is not None:
+            self._reader.cancel()
+
+    async def _read(self):
+        while True:
+            payload = await self._connection.read_message()
+            if payload is None:
+                if self._finished is not None and not self._finished.done():
+                    self._finished.set_exception(ConnectionError('websocket closed'))
+                return
+            msg = ForwardMsg()
+            msg.ParseFromString(payload)
+            kind = msg.WhichOneof('type')
+            if kind == 'delta' and msg.delta.WhichOneof('type') == 'new_element':
+                self._element(msg.delta.new_element, msg.delta.fragment_id)
+            elif kind == 'auto_rerun':
+                self.fragments[msg.auto_rerun.fragment_id] = msg.auto_rerun.interval
+            elif kind == 'script_finished':
+                if msg.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN and self._finished is not None:
+                    if not self._finished.done():
+                        self._finished.set_result(msg.script_finished)
+
+    def _element(self, element, fragment_id: str):
+        kind = element.WhichOneof('type')
+        if kind in ('button', 'slider'):
+            proto = getattr(element, kind)
+            self.widgets[proto.id] = Widget(kind, proto.id, proto.label, fragment_id)
+        elif kind == 'exception':
+            self._errors.append(element.exception.message or element.exception.type)
+
+    async def rerun(self, trigger: Optional[WidgetState] = None, fragment_id: str = '',
+                    auto: bool = False) -> Step:
+        async with self._busy:
+            msg = BackMsg()
+            state = msg.rerun_script
+            state.page_name = self.page
+            state.fragment_id = fragment_id
+            state.is_auto_rerun = auto
+            for value in self.values.values():
+                state.widget_states.widgets.append(value)
+            if trigger is not None:
+                state.widget_states.widgets.append(trigger)
+
+            self._errors = []
+            self._finished = asyncio.get_running_loop().create_future()
+            started = time.perf_counter()
+            error = ''
+            try:
+                await self._connection.write_message(msg.SerializeToString(), binary=True)
+                status = await asyncio.wait_for(self._finished, self.timeout)
+                if status == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    error = 'compile error'
+                elif self._errors:
+                    error = self._errors[0]
+            except asyncio.TimeoutError:
+                error = f"no answer within {self.timeout:g}s"
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            return Step(self.page or MAIN_SCRIPT, '', time.perf_counter() - started, error)
+
+
+def site_buttons(session: Session) -> List[Widget]:
+    """The keyed site buttons (keys ending in _button)"""
+    return [w for w in session.widgets.values() if w.kind == 'button' and w.id.endswith('_button')]
+
+
+async def click_site(session: Session, rng: random.Random) -> Step:
+    button = rng.choice(site_buttons(session))
+    step = await session.rerun(WidgetState(id=button.id, trigger_value=True), button.fragment_id)
+    return step._replace(action='click site')
+
+
+async def drag_slider(session: Session, rng: random.Random) -> Step:
+    slider = next(w for w in session.widgets.values() if w.kind == 'slider')
+    start = rng.randrange(SLIDER_DAYS - 1)
+    end = rng.randrange(start + 1, SLIDER_DAYS)
+    # Date sliders send microseconds since the epoch
+    value = WidgetState(id=slider.id)
+    value.double_array_value.data.extend(
+        (SLIDER_START + datetime.timedelta(days=days) - EPOCH) / datetime.timedelta(microseconds=1)
+        for days in (start, end)
+    )
+    session.values[slider.id] = value
+    step = await session.rerun(fragment_id=slider.fragment_id)
+    return step._replace(action='drag slider')
+
+
+async def refresh(session: Session, rng: random.Random) -> Step:
+    button = next(w for w in session.widgets.values() if w.kind == 'button' and 'Refresh Data' in w.label)
+    step = await session.rerun(WidgetState(id=button.id, trigger_value=True), button.fragment_id)
+    return step._replace(action='refresh')
+
+
+def actions_of(session: Session) -> list:
+    actions = []
+    if site_buttons(session):
+        actions.append(click_site)
+    if any(w.kind == 'slider' for w in session.widgets.values()):
+        actions.append(drag_slider)
+    if any(w.kind == 'button' and 'Refresh Data' in w.label for w in session.widgets.values()):
+        actions.append(refresh)
+    return actions
+
+
+async def keep_fragment_running(session: Session, fragment_id: str, steps: List[Step]):
+    """What the browser does for st.fragment(run_every=...): rerun it on a timer"""
+    while True:
+        await asyncio.sleep(session.fragments[fragment_id])
+        step = await session.rerun(fragment_id=fragment_id, auto=True)
+        steps.append(step._replace(action='timed fragment'))
+
+
+async def simulate_user(url: str, page: str, actions: int, think: float, timeout: float, seed: int,
+                        steps: List[Step]):
+    rng = random.Random(seed)
+    session = Session(url, page, timeout)
+    timers = []
+    try:
+        await session.connect()
+        steps.append((await session.rerun())._replace(action='open'))
+        timers = [
+            asyncio.ensure_future(keep_fragment_running(session, fragment_id, steps))
+            for fragment_id in session.fragments
+        ]
+        available = actions_of(session)
+        for _ in range(actions):
+            await asyncio.sleep(rng.uniform(0, think))
+            if available:
+                steps.append(await rng.choice(available)(session, rng))
+    except Exception as e:
+        steps.append(Step(page or MAIN_SCRIPT, 'open', 0.0, f"{type(e).__name__}: {e}"))
+    finally:
+        for timer in timers:
+            timer.cancel()
+        await session.close()
+
+
+class ServerMonitor:
+    """CPU seconds and peak RSS of the server process, from /proc (Linux)"""
+
+    def __init__(self, pid: int, interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak = self.rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def cpu_seconds(self) -> Optional[float]:
+        try:
+            with open(f'/proc/{self.pid}/stat') as f:
+                # Fields after the command name, which may contain spaces
+                fields = f.read().rsplit(')', 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        except (OSError, ValueError):
+            return None
+
+    def rss(self) -> Optional[int]:
+        try:
+            with open(f'/proc/{self.pid}/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError):
+            return None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            rss = self.rss()
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def latencies(seconds: List[float]) -> dict:
+    if not seconds:
+        return {}
+    p50, p95, p99 = np.percentile(seconds, [50, 95, 99])
+    return {'count': len(seconds), 'p50_ms': round(p50 * 1000, 1), 'p95_ms': round(p95 * 1000, 1),
+            'p99_ms': round(p99 * 1000, 1), 'max_ms': round(max(seconds) * 1000, 1)}
+
+
+def run_level(url: str, server: subprocess.Popen, sessions: int, pages, actions: int, think: float,
+              timeout: float, seed: int) -> dict:
+    """Run `sessions` users at once, spread over the pages"""
+    steps: List[Step] = []
+
+    async def users():
+        await asyncio.gather(*(
+            simulate_user(url, pages[i % len(pages)], actions, think, timeout, seed * 1000 + i, steps)
+            for i in range(sessions)
+        ))
+
+    monitor = ServerMonitor(server.pid)
+    cpu_before = monitor.cpu_seconds()
+    started = time.perf_counter()
+    with monitor:
+        asyncio.run(users())
+    wall = time.perf_counter() - started
+    cpu_after = monitor.cpu_seconds()
+
+    result = {
+        'sessions': sessions,
+        'reruns': len(steps),
+        'errors': sum(1 for step in steps if step.error),
+        'wall_s': round(wall, 3),
+        'reruns_per_s': round(len(steps) / wall, 2),
+        'server_cpu_cores': None if cpu_before is None else round((cpu_after - cpu_before) / wall, 2),
+        'server_rss_peak_mb': None if monitor.peak is None else round(monitor.peak / 2 ** 20, 1),
+    }
+    result.update(latencies([step.seconds for step in steps]))
+    by_page, by_action = collections.defaultdict(list), collections.defaultdict(list)
+    for step in steps:
+        by_page[step.page].append(step.seconds)
+        by_action[step.action].append(step.seconds)
+    result['pages'] = {page: latencies(seconds) for page, seconds in by_page.items()}
+    result['actions'] = {action: latencies(seconds) for action, seconds in by_action.items()}
+    result['first_errors'] = sorted({step.error for step in steps if step.error})[:5]
+    return result
+
+
+def start_server(api_url: str) -> (subprocess.Popen, str):
+    """`streamlit run` of the board on a free port, once it answers its health check"""
+    port = free_port()
+    env = {**os.environ, 'ENERGYBOARD_API_URL': api_url, 'ENERGYBOARD_METRICS_PORT': str(free_port())}
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'streamlit', 'run', MAIN_SCRIPT,
+         '--server.headless=true', f'--server.port={port}', '--server.address=127.0.0.1',
+         '--server.fileWatcherType=none', '--browser.gatherUsageStats=false'],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/_stcore/health', timeout=1) as response:
+                if response.read() == b'ok':
+                    return server, f'ws://127.0.0.1:{port}/_stcore/stream'
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("Streamlit server didn't start within 60s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', default=','.join(map(str, DEFAULT_SESSIONS)),
+                        help='comma separated numbers of concurrent users')
+    parser.add_argument('--pages', default=','.join(DEFAULT_PAGES),
+                        help="comma separated page names, '' for the main script")
+    parser.add_argument('--actions', type=int, default=10, help='actions per user after opening the page')
+    parser.add_argument('--think', type=float, default=1.0, help='maximum seconds between two actions')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds after which a rerun counts as failed')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='loadtest_output.json')
+    args = parser.parse_args()
+
+    from mock_api import MockServer
+
+    pages = args.pages.split(',')
+    api = MockServer(os.path.join(REPO_ROOT, 'api', 'db.json'), port=0).start()
+    server, url = start_server(api.url)
+    print(f"Streamlit on {url}, mock API on {api.url}", file=sys.stderr)
+    try:
+        # One user per page first: imports, workbooks and caches, as on a warm server
+        run_level(url, server, len(pages), pages, 0, 0, args.timeout, args.seed)
+
+        results = []
+        for sessions in map(int, args.sessions.split(',')):
+            result = run_level(url, server, sessions, pages, args.actions, args.think, args.timeout, args.seed)
+            results.append(result)
+            print(f"{sessions:4d} users: p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, "
+                  f"p99 {result['p99_ms']} ms, {result['errors']}/{result['reruns']} errors, "
+                  f"{result['server_cpu_cores']} cores, RSS {result['server_rss_peak_mb']} MB", file=sys.stderr)
+    finally:
+        server.terminate()
+        server.wait(10)
+        api.stop()
+
+    report = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'pages': pages,
+        'actions': args.actions,
+        'think_s': args.think,
+        'levels': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
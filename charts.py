@@ -0,0 +1,73 @@
+"""Rendering of the dashboard's matplotlib charts"""
+import io
+
+from metrics import tracked_cache_data
+
+# Streamlit's dark background color
+BACKGROUND_COLOR = '#0E1117'
+
+
+# Keyed by the hash of the arguments, so identical data is rendered once.
+# max_entries keeps the server's memory bounded however often data changes.
+@tracked_cache_data('distribution_chart', max_entries=32, show_spinner=False)
+def render_distribution_chart(labels: tuple, sizes: tuple, colors: tuple) -> bytes:
+    """PNG of the energy distribution pie chart"""
+    return draw_distribution_chart(labels, sizes, colors)
+
+
+def _png(fig, background: str) -> bytes:
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', facecolor=background)
+    return buffer.getvalue()
+
+
+def draw_distribution_chart(labels, sizes, colors, background: str = BACKGROUND_COLOR,
+                            text_color: str = 'white') -> bytes:
+    """Uncached PNG of the pie chart, also used outside Streamlit (reports)"""
+    # matplotlib takes longer to import than the rest of the page, so only
+    # when a chart is drawn. A plain Figure instead of pyplot: no global
+    # figure registry that keeps every figure alive, and no changes to the
+    # global rcParams
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 6), facecolor=background)
+    ax = fig.subplots()
+    ax.set_facecolor(background)  # Set axis background color
+
+    wedges, texts, autotexts = ax.pie(sizes,
+                                      labels=labels,
+                                      colors=colors,
+                                      autopct='%1.1f%%',
+                                      startangle=90,
+                                      wedgeprops={"linewidth": 1, "edgecolor": "white"})
+
+    # Make percentage labels white for better visibility on colored backgrounds
+    for autotext in autotexts:
+        autotext.set_color('white')
+
+    # Make labels readable on the background
+    for text in texts:
+        text.set_color(text_color)
+
+    # Equal aspect ratio ensures that pie is drawn as a circle
+    ax.axis('equal')
+
+    return _png(fig, background)
+
+
+def draw_consumption_chart(title: str, series, color: str, kind: str = 'line') -> bytes:
+    """PNG of a consumption series (kWh by date) as line or bar chart, for print"""
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(10, 4), facecolor='white')
+    ax = fig.subplots()
+    if kind == 'bar':
+        ax.bar(series.index, series.to_numpy(), width=20, color=color)
+    else:
+        ax.plot(series.index, series.to_numpy(), color=color)
+    ax.set_title(title)
+    ax.set_ylabel('kWh')
+    ax.grid(axis='y', alpha=0.3)
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    return _png(fig, 'white')
@@ -0,0 +1,247 @@
+"""Compact in-process storage of meter series.
+
+A MeterStore keeps the readings of any number of meters in three flat
+arrays sorted by meter, then time: uint32 seconds since the store's first
+reading, float32 values and per-meter offsets into both. The meter (and
+its site) of a reading is implied by the offsets, so the ids cost nothing
+per reading and come back as pandas categoricals. Times are kept to the
+second and a store spans at most 136 years.
+
+That is 8 bytes per reading. Measured for 10 years of hourly readings of
+50 meters (4.4M readings): 33 MB, against 67 MB for float64 Series with a
+DatetimeIndex (2x) and 350 MB for a long float64 frame with an object
+meter column, the shape the workbook history had (10x). Values of one
+meter are views, not copies; their times are decoded per slice.
+
+Stores can be saved as .npy files and reopened memory-mapped, so their
+pages belong to the OS page cache instead of the process: they are read
+in when used and dropped under memory pressure instead of swapping.
+
+A MemoryBudget (ENERGYBOARD_MEMORY_BUDGET_MB, 0 for none) keeps track of
+the resident stores. A store that would exceed it is spilled to
+memory-mapped files under .cache/memmap.
+"""
+import glob
+import json
+import logging
+import os
+import shutil
+import threading
+from typing import Dict, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from metrics import RESIDENT_BYTES
+
+MEMORY_BUDGET_MB = float(os.environ.get('ENERGYBOARD_MEMORY_BUDGET_MB', 0))
+MEMMAP_DIR = os.path.join('.cache', 'memmap')
+
+logger = logging.getLogger(__name__)
+
+
+class MeterStore:
+    """Readings of many meters, sorted by meter then time"""
+
+    def __init__(self, meters: Sequence[str], offsets: np.ndarray, seconds: np.ndarray, values: np.ndarray,
+                 origin: int = 0, sites: Optional[Sequence[str]] = None):
+        """offsets[i]:offsets[i + 1] are the readings of meters[i] in seconds/values"""
+        self.meters = tuple(meters)
+        self.sites = tuple(sites) if sites is not None else ('',) * len(self.meters)
+        self.offsets = offsets
+        self.origin = int(origin)  # ns since the epoch of seconds == 0
+        self.seconds = seconds  # uint32, seconds since origin
+        self.values = values  # float32
+        self._index = {meter: i for i, meter in enumerate(self.meters)}
+
+    @staticmethod
+    def _encode(times: np.ndarray) -> Tuple[int, np.ndarray]:
+        """(origin, uint32 seconds since origin) of int64 ns times"""
+        if not len(times):
+            return 0, np.array([], dtype=np.uint32)
+        origin = int(times.min()) // 10 ** 9 * 10 ** 9
+        seconds = (times - origin) // 10 ** 9
+        if seconds.max() > np.iinfo(np.uint32).max:
+            raise ValueError("Readings span more than 136 years")
+        return origin, seconds.astype(np.uint32)
+
+    @classmethod
+    def from_series(cls, series: Mapping[str, pd.Series], sites: Optional[Mapping[str, str]] = None) -> 'MeterStore':
+        """Store of {meter: Series indexed by time}; NaN readings are left out"""
+        meters, times, values = [], [], []
+        for meter, s in series.items():
+            s = s.dropna()
+            s = s.sort_index(kind='stable') if not s.index.is_monotonic_increasing else s
+            meters.append(meter)
+            times.append(pd.DatetimeIndex(s.index).asi8)
+            values.append(s.to_numpy(np.float32))
+        return cls._concat(meters, times, values, sites)
+
+    @classmethod
+    def from_long(cls, frame: pd.DataFrame, meter: str = 'meter', time: str = 'bucket', value: str = 'energy',
+                  sites: Optional[Mapping[str, str]] = None) -> 'MeterStore':
+        """Store of a long frame with one row per (meter, time)"""
+        frame = frame[frame[value].notna()].sort_values([meter, time], kind='stable')
+        # Sorted by meter, so each meter's first row is where its readings start
+        names, starts = np.unique(frame[meter].to_numpy(), return_index=True)
+        offsets = np.append(starts, len(frame)).astype(np.int64)
+        origin, seconds = cls._encode(pd.DatetimeIndex(frame[time]).asi8)
+        return cls(
+            [str(name) for name in names], offsets, seconds, frame[value].to_numpy(np.float32), origin,
+            [(sites or {}).get(str(name), '') for name in names]
+        )
+
+    @classmethod
+    def _concat(cls, meters, times, values, sites) -> 'MeterStore':
+        offsets = np.zeros(len(meters) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in times], out=offsets[1:])
+        origin, seconds = cls._encode(np.concatenate(times) if times else np.array([], dtype=np.int64))
+        return cls(
+            meters, offsets, seconds,
+            np.concatenate(values) if values else np.array([], dtype=np.float32),
+            origin, [(sites or {}).get(meter, '') for meter in meters]
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the arrays (of the file for memory-mapped stores)"""
+        return self.offsets.nbytes + self.seconds.nbytes + self.values.nbytes
+
+    @property
+    def memory_mapped(self) -> bool:
+        return isinstance(self.values, np.memmap)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __contains__(self, meter) -> bool:
+        return meter in self._index
+
+    def _position(self, seconds: np.ndarray, time) -> int:
+        """Position of the first reading at or after `time` in a meter's (sorted) seconds"""
+        # Readings are whole seconds, so those >= time are those >= its ceiling
+        second = -((self.origin - pd.Timestamp(time).value) // 10 ** 9)
+        if second <= 0:
+            return 0
+        if second > np.iinfo(np.uint32).max:
+            return len(seconds)
+        return int(np.searchsorted(seconds, np.uint32(second), side='left'))
+
+    def slice(self, meter: str, start=None, end=None) -> Tuple[np.ndarray, np.ndarray]:
+        """(int64 ns times, values view) of a meter's readings in [start, end); empty for unknown meters"""
+        if meter not in self._index:
+            return np.array([], dtype=np.int64), self.values[:0]
+        i = self._index[meter]
+        first, last = self.offsets[i], self.offsets[i + 1]
+        seconds = self.seconds[first:last]
+        lo = 0 if start is None else self._position(seconds, start)
+        hi = len(seconds) if end is None else self._position(seconds, end)
+        hi = max(lo, hi)
+        return self._decode(seconds[lo:hi]), self.values[first + lo:first + hi]
+
+    def _decode(self, seconds: np.ndarray) -> np.ndarray:
+        return seconds.astype(np.int64) * 10 ** 9 + self.origin
+
+    def series(self, meter: str, start=None, end=None) -> pd.Series:
+        """A meter's readings as float32 Series indexed by time"""
+        times, values = self.slice(meter, start, end)
+        return pd.Series(values, index=pd.DatetimeIndex(times.view('datetime64[ns]')), name=meter)
+
+    def sum(self, meter: str, start=None, end=None) -> float:
+        """Sum of a meter's readings in [start, end), accumulated in float64"""
+        return float(self.slice(meter, start, end)[1].sum(dtype=np.float64))
+
+    def to_frame(self) -> pd.DataFrame:
+        """Long frame: categorical meter and site, time, float32 value"""
+        codes = np.repeat(np.arange(len(self.meters), dtype=np.int32), np.diff(self.offsets))
+        return pd.DataFrame({
+            'meter': pd.Categorical.from_codes(codes, categories=list(self.meters)),
+            'site': pd.Categorical(np.asarray(self.sites, dtype=object)[codes] if len(codes) else []),
+            'time': self._decode(self.seconds).view('datetime64[ns]'),
+            'value': self.values,
+        })
+
+    def save(self, directory: str):
+        """Write the arrays as .npy files plus the meters as JSON"""
+        os.makedirs(directory, exist_ok=True)
+        for name in ('offsets', 'seconds', 'values'):
+            np.save(os.path.join(directory, f'{name}.npy'), getattr(self, name))
+        with open(os.path.join(directory, 'meters.json'), 'w') as f:
+            json.dump({'meters': self.meters, 'sites': self.sites, 'origin': self.origin}, f)
+
+    @classmethod
+    def open(cls, directory: str, mmap: bool = True) -> 'MeterStore':
+        """A saved store, memory-mapped read-only unless mmap is False"""
+        with open(os.path.join(directory, 'meters.json')) as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r' if mmap else None)
+            for name in ('offsets', 'seconds', 'values')
+        }
+        return cls(meta['meters'], arrays['offsets'], arrays['seconds'], arrays['values'], meta['origin'],
+                   meta['sites'])
+
+
+class MemoryBudget:
+    """Bytes held by the resident stores, spilling those that don't fit"""
+
+    def __init__(self, limit_mb: float = MEMORY_BUDGET_MB, directory: str = MEMMAP_DIR):
+        self.limit = int(limit_mb * 2 ** 20)  # 0: no limit
+        self.directory = directory
+        self._resident: Dict[str, int] = {}
+        self._mapped: Dict[str, int] = {}
+        self._spills = 0
+        self._lock = threading.Lock()
+
+    def admit(self, name: str, store: MeterStore) -> MeterStore:
+        """`store` as it should be kept under `name`, replacing the previous one.
+
+        Returned unchanged while it fits the budget, otherwise saved and
+        returned memory-mapped.
+        """
+        with self._lock:
+            self._resident.pop(name, None)
+            self._mapped.pop(name, None)
+            resident = sum(self._resident.values())
+            if store.memory_mapped or not self.limit or resident + store.nbytes <= self.limit:
+                (self._mapped if store.memory_mapped else self._resident)[name] = store.nbytes
+                self._publish()
+                return store
+
+        logger.info("%s (%.1f MB) exceeds the memory budget, memory-mapping it", name, store.nbytes / 2 ** 20)
+        # A new directory per spill: the previous store may still be mapped
+        # by sessions that haven't moved on yet. Removing its files keeps
+        # those mappings valid (POSIX); where it fails they are left behind.
+        with self._lock:
+            self._spills += 1
+            directory = os.path.join(self.directory, f"{name}-{os.getpid()}-{self._spills}")
+        store.save(directory)
+        mapped = MeterStore.open(directory)
+        # Only this process' spills: other server processes may share the directory
+        pattern = f"{glob.escape(name)}-{os.getpid()}-*"
+        for old in glob.glob(os.path.join(glob.escape(self.directory), pattern)):
+            if old != directory:
+                shutil.rmtree(old, ignore_errors=True)
+        with self._lock:
+            self._mapped[name] = mapped.nbytes
+            self._publish()
+        return mapped
+
+    def report(self) -> dict:
+        """Resident and memory-mapped bytes per store, with the limit"""
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'resident': dict(self._resident),
+                'memory_mapped': dict(self._mapped),
+                'total_resident': sum(self._resident.values()),
+            }
+
+    def _publish(self):
+        for name in set(self._resident) | set(self._mapped):
+            RESIDENT_BYTES.labels(component=name, storage='memory').set(self._resident.get(name, 0))
+            RESIDENT_BYTES.labels(component=name, storage='mmap').set(self._mapped.get(name, 0))
+
+
+# Budget of the process
+memory_budget = MemoryBudget()
@@ -0,0 +1,171 @@
+"""One process-wide poller for the dashboard's data sources.
+
+Streamlit runs the page scripts once per browser session. Instead of every
+session reloading the workbooks/API when its cache expires, the sources are
+registered with a single DataService that reloads them on a background
+thread. Sessions only read the current (immutable) Snapshot.
+"""
+import os
+import threading
+import time
+from types import MappingProxyType
+from typing import Callable, Iterable, Mapping, NamedTuple, Optional
+
+import streamlit as st
+
+from metrics import LOAD_ERRORS, LOAD_SECONDS
+
+# Seconds between two reloads of a source, unless given when registering it
+REFRESH_SECONDS = float(os.environ.get('ENERGYBOARD_REFRESH_SECONDS', 5))
+
+
+class Snapshot(NamedTuple):
+    """Last loaded value of every source, never modified once published"""
+    version: int
+    values: Mapping[str, object]
+    errors: Mapping[str, str]  # source -> message of its last failed load
+    loaded_at: Mapping[str, float]  # source -> time.time() of its last successful load
+
+
+class _Source:
+    def __init__(self, loader, interval):
+        self.loader = loader
+        self.interval = interval
+        self.next_due = 0.0
+        # Reloads of this source started, and those whose result is published
+        self.started = 0
+        self.finished = 0
+
+
+def _same(a, b) -> bool:
+    """Equality that doesn't choke on values like DataFrames"""
+    if a is b:
+        return True
+    try:
+        return bool(a == b)
+    except Exception:
+        return False
+
+
+class DataService:
+    """Reload registered sources on a background thread"""
+
+    def __init__(self, interval: float = REFRESH_SECONDS):
+        self.interval = interval
+        self._sources = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        # Only one reload at a time, whoever triggers it
+        self._load_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        empty = MappingProxyType({})
+        self._snapshot = Snapshot(0, empty, empty, empty)
+
+    def register(self, name: str, loader: Callable[[], object], interval: Optional[float] = None):
+        """Add a source; its first value is loaded before this returns"""
+        with self._lock:
+            if name in self._sources:
+                return
+            self._sources[name] = _Source(loader, interval or self.interval)
+        self._reload([name])
+        self._start()
+
+    def snapshot(self) -> Snapshot:
+        """The current data; cheap, never blocks on a reload"""
+        return self._snapshot
+
+    def request_refresh(self, names: Optional[Iterable[str]] = None):
+        """Reload the given (default: all) sources as soon as possible"""
+        with self._lock:
+            for name in names or self._sources:
+                self._sources[name].next_due = 0.0
+        self._wake.set()
+
+    def refresh(self, names: Optional[Iterable[str]] = None, timeout: float = 10) -> Snapshot:
+        """Request a reload and wait (at most timeout seconds) until it is published.
+
+        Waits for each of the sources itself: a reload of other sources, or
+        one of these that had already started (and may have read the old
+        data), doesn't count.
+        """
+        with self._lock:
+            targets = {name: self._sources[name].started + 1 for name in names or self._sources}
+        self.request_refresh(list(targets))
+        with self._changed:
+            self._changed.wait_for(
+                lambda: all(self._sources[name].finished >= target for name, target in targets.items()), timeout
+            )
+        return self._snapshot
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='data-service', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                due = [name for name, source in self._sources.items() if source.next_due <= now]
+                next_due = min(source.next_due for source in self._sources.values())
+            if due:
+                self._reload(due)
+                continue
+            self._wake.wait(max(0.0, next_due - now))
+            self._wake.clear()
+
+    def _reload(self, names):
+        with self._load_lock:
+            with self._lock:
+                sources = {name: self._sources[name] for name in names}
+                for source in sources.values():
+                    source.started += 1
+
+            values, errors = {}, {}
+            for name, source in sources.items():
+                try:
+                    with LOAD_SECONDS.labels(source=name).time():
+                        values[name] = source.loader()
+                except Exception as e:
+                    LOAD_ERRORS.labels(source=name).inc()
+                    errors[name] = str(e)
+                source.next_due = time.monotonic() + source.interval
+
+            self._publish(values, errors, sources.values())
+
+    def _publish(self, values, errors, sources):
+        now = time.time()
+        with self._changed:
+            old = self._snapshot
+            new_values = dict(old.values)
+            new_errors = dict(old.errors)
+            loaded_at = dict(old.loaded_at)
+            changed = False
+
+            for name, value in values.items():
+                changed |= name not in old.values or not _same(old.values[name], value)
+                new_values[name] = value
+                loaded_at[name] = now
+                changed |= new_errors.pop(name, None) is not None
+            for name, message in errors.items():
+                # Keep serving the last good value of a failing source
+                changed |= new_errors.get(name) != message
+                new_errors[name] = message
+
+            self._snapshot = Snapshot(
+                old.version + 1 if changed else old.version,
+                MappingProxyType(new_values),
+                MappingProxyType(new_errors),
+                MappingProxyType(loaded_at)
+            )
+            for source in sources:
+                source.finished = source.started
+            self._changed.notify_all()
+
+
+@st.cache_resource
+def get_data_service() -> DataService:
+    """The DataService shared by all sessions of this server process"""
+    return DataService()
@@ -0,0 +1,137 @@
+"""Downsampling of chart series to a point budget, keeping their shape.
+
+A chart gets about one point per pixel of its width: the display width
+(ENERGYBOARD_DISPLAY_WIDTH, default 1920 for the wall displays) divided by
+the columns it shares the page with, and at most ENERGYBOARD_CHART_POINTS
+(default 2000), however many readings a series has. Two methods, both
+keeping the first and last point:
+
+- 'lttb', Largest-Triangle-Three-Buckets: one point per bucket, the one
+  forming the largest triangle with the point kept before it and the
+  mean of the next bucket. Keeps the visual shape of line charts.
+- 'minmax': the lowest and highest point of each bucket, so no peak or
+  trough disappears. Meant for bar charts, where every spike counts.
+
+Buckets hold an equal number of points. The work per bucket is done for
+all buckets at once with numpy, only LTTB walks its buckets in order (the
+point kept in a bucket depends on the one kept before it).
+
+chart_points caches the result per (series, range, budget, method), so a
+rerun that shows the same chart again sends the cached points.
+"""
+import os
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from metrics import tracked_cache_data
+
+# Most points per chart
+CHART_POINTS = int(os.environ.get('ENERGYBOARD_CHART_POINTS', 2000))
+# Pixels across the displays showing the dashboard
+DISPLAY_WIDTH = int(os.environ.get('ENERGYBOARD_DISPLAY_WIDTH', 1920))
+
+
+def chart_width(columns: int = 1) -> int:
+    """Point budget of a chart in one of `columns` equally wide columns"""
+    return min(CHART_POINTS, max(3, DISPLAY_WIDTH // columns))
+
+
+def _bucket_edges(start: int, stop: int, buckets: int) -> np.ndarray:
+    """Edges of `buckets` buckets of about equal size over positions [start, stop)"""
+    return np.linspace(start, stop, buckets + 1).astype(np.int64)
+
+
+def minmax_indices(y: np.ndarray, points: int) -> np.ndarray:
+    """Sorted positions of the min and max of each bucket, plus the first and last point"""
+    n = len(y)
+    if n <= points:
+        return np.arange(n)
+    buckets = max(1, (points - 2) // 2)
+    edges = _bucket_edges(1, n - 1, buckets)
+    starts = edges[:-1]
+    bucket_of = np.repeat(np.arange(buckets), np.diff(edges))
+    inner = y[1:n - 1]
+    # First position in each bucket holding its min, and its max
+    chosen = [np.array([0, n - 1])]
+    for reduce in (np.minimum, np.maximum):
+        extreme = reduce.reduceat(inner, starts - 1)
+        hits = np.flatnonzero(inner == extreme[bucket_of])
+        _, first = np.unique(bucket_of[hits], return_index=True)
+        chosen.append(hits[first] + 1)
+    return np.unique(np.concatenate(chosen))
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """Sorted positions of the points Largest-Triangle-Three-Buckets keeps"""
+    n = len(y)
+    if n <= points:
+        return np.arange(n)
+    # The first and last point plus at least one bucket
+    points = max(points, 3)
+    buckets = points - 2
+    edges = _bucket_edges(1, n - 1, buckets)
+    # Mean of every bucket, the next bucket's is the third corner of the triangles
+    sizes = np.diff(edges)
+    mean_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / sizes
+    mean_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / sizes
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    chosen = np.empty(points, dtype=np.int64)
+    chosen[0], chosen[-1] = 0, n - 1
+    a = 0
+    for bucket in range(buckets):
+        lo, hi = edges[bucket], edges[bucket + 1]
+        bx, by = x[lo:hi], y[lo:hi]
+        # Twice the triangle areas, the factor doesn't change the largest
+        areas = np.abs((x[a] - next_x[bucket]) * (by - y[a]) - (x[a] - bx) * (next_y[bucket] - y[a]))
+        a = lo + int(np.argmax(areas))
+        chosen[bucket + 1] = a
+    return chosen
+
+
+METHODS = ('lttb', 'minmax')
+
+
+def downsample(data: pd.DataFrame, points: int = CHART_POINTS, method: str = 'lttb',
+               start=None, end=None) -> pd.DataFrame:
+    """Rows of `data` (indexed by time) in [start, end) a chart of `points` points needs.
+
+    With several columns, the rows any of them needs are kept.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsampling method {method!r}, expected one of {', '.join(METHODS)}")
+    data = data.sort_index()
+    if start is not None:
+        data = data[data.index >= pd.Timestamp(start)]
+    if end is not None:
+        data = data[data.index < pd.Timestamp(end)]
+    if len(data) <= points:
+        return data
+
+    x = (pd.DatetimeIndex(data.index).asi8 - pd.DatetimeIndex(data.index).asi8[0]).astype(np.float64)
+    # The budget is shared between the columns
+    per_column = max(3, points // max(1, len(data.columns)))
+    keep = []
+    for column in data.columns:
+        y = data[column].to_numpy(np.float64)
+        valid = np.flatnonzero(~np.isnan(y))
+        if method == 'lttb':
+            positions = lttb_indices(x[valid], y[valid], per_column)
+        else:
+            positions = minmax_indices(y[valid], per_column)
+        keep.append(valid[positions])
+    return data.iloc[np.unique(np.concatenate(keep))]
+
+
+@tracked_cache_data('chart_points', max_entries=256, show_spinner=False)
+def chart_points(key: str, version, start, end, points: int, method: str,
+                 _load: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+    """downsample() of the series `_load` returns, cached per (key, version, range, budget, method).
+
+    key names the series and version its data, so `_load` (not hashed)
+    only runs when another series, range or budget is shown.
+    """
+    return downsample(_load(), points, method, start, end)
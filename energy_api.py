@@ -0,0 +1,165 @@
+"""Client for the energy data API.
+
+For local development the API is a json-server serving api/db.json:
+
+    npx json-server --watch api/db.json --port 3000
+
+or its Python stand-in, which also answers unchanged data with a 304:
+
+    python mock_api.py --db api/db.json --port 3000
+
+Point ENERGYBOARD_API_URL at another server to test against it.
+"""
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+# API configuration
+API_BASE_URL = os.environ.get('ENERGYBOARD_API_URL', 'http://localhost:3000')  # JSON Server URL
+PRODUCTION_API_URL = 'https://your-real-api.com'  # Your real API URL for later
+
+# Set this to False to use production API
+USE_MOCK_API = True
+
+# (connect, read) timeouts in seconds
+TIMEOUT = (3.05, 10)
+
+# Media type of Arrow IPC streams. energy_data is asked for as Arrow first,
+# servers that only speak JSON (json-server) ignore it and send JSON.
+ARROW_STREAM = 'application/vnd.apache.arrow.stream'
+FRAME_ACCEPT = f'{ARROW_STREAM}, application/json;q=0.5'
+
+# Readings shown when the API can't be reached
+DEFAULT_READINGS = {
+    "Halloeins": 100,
+    "Hallozwei": 100,
+    "Hallodrei": 100
+}
+
+
+class EnergyAPI:
+    """API client keeping its connections open between calls"""
+
+    def __init__(self, base_url=None, timeout=TIMEOUT, pool_size=10):
+        self.base_url = base_url or (API_BASE_URL if USE_MOCK_API else PRODUCTION_API_URL)
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Runs the requests of fetch_all() side by side
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='energy-api')
+        # path -> (ETag, parsed body) of the last GET, to revalidate instead of downloading
+        self._etags = {}
+        # Last energy_data body and its DataFrame, rebuilt only when the body changed
+        self._energy_frame = (None, pd.DataFrame())
+
+    def _request(self, method, path, **kwargs):
+        cached = self._etags.get(path) if method == 'GET' else None
+        if cached:
+            kwargs['headers'] = {**kwargs.get('headers', {}), 'If-None-Match': cached[0]}
+        response = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+        if cached and response.status_code == 304:
+            # Unchanged: the same object as last time
+            return cached[1]
+        response.raise_for_status()
+        if response.headers.get('Content-Type', '').startswith(ARROW_STREAM):
+            data = arrow_to_frame(response.content)
+        else:
+            data = response.json()
+        if method == 'GET' and 'ETag' in response.headers:
+            self._etags[path] = (response.headers['ETag'], data)
+        return data
+
+    def _energy_data_frame(self, energy_data) -> pd.DataFrame:
+        """DataFrame of an energy_data body, an Arrow response already is one"""
+        if isinstance(energy_data, pd.DataFrame):
+            return energy_data
+        body, frame = self._energy_frame
+        if energy_data is not body:
+            frame = pd.DataFrame(energy_data)
+            if 'timestamp' in frame:
+                # Same types as from Arrow
+                frame['timestamp'] = pd.to_datetime(frame['timestamp'])
+            self._energy_frame = (energy_data, frame)
+        return frame
+
+    def get_energy_data(self) -> pd.DataFrame:
+        """Get energy data from API"""
+        try:
+            return self._energy_data_frame(self._request('GET', '/energy_data', headers={'Accept': FRAME_ACCEPT}))
+        except Exception as e:
+            st.error(f"Error fetching data: {e}")
+            return pd.DataFrame()
+
+    def get_latest_readings(self) -> dict:
+        """Get latest sensor readings from API"""
+        try:
+            return self._request('GET', '/latest_readings')
+        except Exception as e:
+            st.error(f"Error fetching latest readings: {e}")
+            # Return default values if API call fails
+            return dict(DEFAULT_READINGS)
+
+    @staticmethod
+    def _random_readings() -> dict:
+        return {
+            "Halloeins": random.uniform(80, 120),
+            "Hallozwei": random.uniform(80, 120),
+            "Hallodrei": random.uniform(80, 120)
+        }
+
+    def update_latest_readings(self) -> dict:
+        """Update latest readings with random variations, return the stored readings"""
+        try:
+            # json-server answers a PUT with the stored resource
+            return self._request('PUT', '/latest_readings', json=self._random_readings())
+        except Exception as e:
+            st.error(f"Error updating readings: {e}")
+            return dict(DEFAULT_READINGS)
+
+    def next_readings(self) -> dict:
+        """Readings for the next tick in a single round-trip; raises on errors"""
+        if USE_MOCK_API:
+            # Simulate new sensor values; the PUT response already holds them
+            return self._request('PUT', '/latest_readings', json=self._random_readings())
+        return self._request('GET', '/latest_readings')
+
+    def fetch_all(self) -> dict:
+        """Energy data and latest readings, requested concurrently.
+
+        Unlike the single getters this raises on errors, so callers such as
+        the data service can report them.
+        """
+        energy_data = self._executor.submit(self._request, 'GET', '/energy_data', headers={'Accept': FRAME_ACCEPT})
+        latest_readings = self._executor.submit(self._request, 'GET', '/latest_readings')
+        return {
+            'energy_data': self._energy_data_frame(energy_data.result()),
+            'latest_readings': latest_readings.result()
+        }
+
+
+def arrow_to_frame(body: bytes) -> pd.DataFrame:
+    """DataFrame of an Arrow IPC stream.
+
+    Numbers and timestamps without nulls are used in place from the
+    response's memory, strings stay Arrow strings instead of one Python
+    object per cell.
+    """
+    table = pa.ipc.open_stream(pa.py_buffer(body)).read_all()
+    return table.to_pandas(
+        split_blocks=True, self_destruct=True,
+        types_mapper=lambda t: pd.ArrowDtype(t) if pa.types.is_string(t) or pa.types.is_large_string(t) else None
+    )
+
+
+@st.cache_resource
+def get_api_client() -> EnergyAPI:
+    """One client, and so one connection pool, per server process"""
+    return EnergyAPI()
@@ -0,0 +1,531 @@
+"""Reading of the 'Fest' sheet of the meter workbooks"""
+import concurrent.futures
+import datetime
+import glob
+import hashlib
+import importlib.util
+import json
+import logging
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, NamedTuple, Tuple
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from metrics import count_cache
+from registry import Source, load_registry
+
+# Rows 1-2 are title rows and row 3 is used as header by
+# pd.read_excel(..., skiprows=2), so data starts in row 4
+FIRST_DATA_ROW = 4
+
+# Parsed workbooks are kept here as Parquet files, one per content hash
+CACHE_DIR = os.path.join('.cache', 'workbooks')
+
+# Reader of the workbooks: 'openpyxl', 'calamine' (python-calamine, much
+# faster) or 'auto' for calamine when it is installed
+EXCEL_ENGINE = os.environ.get('ENERGYBOARD_EXCEL_ENGINE', 'auto')
+
+# path -> ((mtime, size), sha256), so unchanged files are not hashed again
+_hash_memo = {}
+_hash_lock = threading.Lock()
+
+
+def is_missing(value) -> bool:
+    """Same notion of 'empty' as pandas' dropna() on a read_excel column"""
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def content_hash(path) -> str:
+    """sha256 of the file's bytes, remembered as long as mtime/size don't change"""
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _hash_lock:
+        memo = _hash_memo.get(path)
+        if memo is not None and memo[0] == key:
+            return memo[1]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+
+    with _hash_lock:
+        _hash_memo[path] = (key, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _typed_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Numeric and date columns of a parsed sheet as such, like pd.read_excel() would"""
+    df = df.copy()
+    for i in range(df.shape[1]):
+        column = df.iloc[:, i]
+        if column.dtype != object:
+            continue
+
+        values = column.dropna()
+        if values.map(_is_number).all():
+            df.isetitem(i, pd.to_numeric(column))
+        elif values.map(lambda v: isinstance(v, datetime.datetime)).all():
+            df.isetitem(i, pd.to_datetime(column))
+        # Mixed columns (labels next to formulas) keep their cells as they are
+
+    return df
+
+
+def _encode(value) -> Tuple[str, str]:
+    """(type, text) of a cell or column label, as kept in the Parquet copy"""
+    if value is None:
+        return 'none', ''
+    if isinstance(value, (bool, np.bool_)):
+        return 'bool', str(bool(value))
+    if isinstance(value, (int, np.integer)):
+        return 'int', str(int(value))
+    if isinstance(value, (float, np.floating)):
+        return 'float', repr(float(value))
+    if isinstance(value, datetime.datetime):
+        return 'datetime', value.isoformat()
+    if isinstance(value, datetime.date):
+        return 'date', value.isoformat()
+    if isinstance(value, datetime.time):
+        return 'time', value.isoformat()
+    return 'str', str(value)
+
+
+_DECODERS = {
+    'none': lambda text: None,
+    'bool': lambda text: text == 'True',
+    'int': int,
+    'float': float,
+    'datetime': datetime.datetime.fromisoformat,
+    'date': datetime.date.fromisoformat,
+    'time': datetime.time.fromisoformat,
+    'str': str,
+}
+
+
+def _decode(kind: str, text: str):
+    return _DECODERS[kind](text)
+
+
+# Key of the column labels and types in the Parquet copies' metadata
+_COLUMNS_KEY = b'energyboard.columns'
+
+
+def _parquet_table(df: pd.DataFrame) -> pa.Table:
+    """`df` as an Arrow table that _read_parquet() turns back into the same frame.
+
+    Parquet wants string column names and one type per column, so columns
+    are stored by position, with their labels in the metadata. Mixed
+    columns are stored as text next to a column with the type of each cell.
+    """
+    data, columns = {}, []
+    for i in range(df.shape[1]):
+        column = df.iloc[:, i]
+        mixed = column.dtype == object
+        if mixed:
+            cells = [_encode(value) for value in column]
+            data[f'{i}:type'] = [kind for kind, _ in cells]
+            data[str(i)] = [text for _, text in cells]
+        else:
+            data[str(i)] = column.to_numpy()
+        columns.append({'label': _encode(df.columns[i]), 'mixed': mixed})
+    table = pa.Table.from_pandas(pd.DataFrame(data, index=df.index), preserve_index=False)
+    return table.replace_schema_metadata({
+        **(table.schema.metadata or {}), _COLUMNS_KEY: json.dumps(columns).encode()
+    })
+
+
+def _read_parquet(cache_path) -> pd.DataFrame:
+    """The frame a Parquet copy was written from, with its labels and cell types"""
+    table = pq.read_table(cache_path)
+    columns = json.loads(table.schema.metadata[_COLUMNS_KEY])
+    stored = table.to_pandas()
+    data = {}
+    for i, column in enumerate(columns):
+        if column['mixed']:
+            data[i] = pd.Series(
+                [_decode(kind, text) for kind, text in zip(stored[f'{i}:type'], stored[str(i)])], dtype=object
+            )
+        else:
+            data[i] = stored[str(i)]
+    df = pd.DataFrame(data)
+    df.columns = [_decode(*column['label']) for column in columns]
+    return df
+
+
+def _write_parquet(df: pd.DataFrame, cache_path):
+    """Write to a temporary file first so readers never see half a file"""
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        pq.write_table(_parquet_table(df), tmp_path)
+        os.replace(tmp_path, cache_path)
+    except Exception:
+        # The cache is only an accelerator, the parsed frame is still returned
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _cached(path, name, parse) -> pd.DataFrame:
+    """parse() backed by a Parquet copy named after the workbook's content hash.
+
+    The copy is rebuilt exactly when the workbook's bytes change; `name`
+    tells apart the different reads of one workbook.
+    """
+    digest = content_hash(path)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    prefix = os.path.join(CACHE_DIR, f"{stem}-{name}-")
+    cache_path = f"{prefix}{digest}.parquet"
+
+    if os.path.exists(cache_path):
+        try:
+            df = _read_parquet(cache_path)
+            count_cache('parquet', hit=True)
+            return df
+        except Exception:
+            pass  # Unreadable cache file, parse the workbook again
+    count_cache('parquet', hit=False)
+
+    df = _typed_frame(parse())
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    _write_parquet(df, cache_path)
+    # Drop the copies of older versions of this workbook
+    for old_path in glob.glob(f"{glob.escape(prefix)}*.parquet"):
+        if old_path != cache_path:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+    return df
+
+
+def read_sheet(path, sheet_name='Fest', skiprows=2) -> pd.DataFrame:
+    """pd.read_excel() of the whole sheet, backed by a Parquet copy"""
+    return _cached(
+        path, f"{sheet_name}-{skiprows}-all",
+        lambda: pd.read_excel(path, sheet_name=sheet_name, skiprows=skiprows)
+    )
+
+
+def excel_engine() -> str:
+    """'calamine' if configured or, by default, if python-calamine is installed"""
+    if EXCEL_ENGINE == 'auto':
+        return 'calamine' if importlib.util.find_spec('python_calamine') else 'openpyxl'
+    return EXCEL_ENGINE
+
+
+def _stream_columns(path, columns, sheet_name, skiprows) -> pd.DataFrame:
+    """Rows of the sheet in read-only mode, keeping only `columns`.
+
+    Cells left of the first and right of the last wanted column are never
+    materialised, and only the wanted columns are stored.
+    """
+    first, last = min(columns), max(columns)
+    data = {column: [] for column in columns}
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook[sheet_name].iter_rows(
+            # The row after the skipped ones is the header, as in pd.read_excel
+            min_row=skiprows + 2, min_col=first + 1, max_col=last + 1, values_only=True
+        )
+        filled = 0
+        for row in rows:
+            for column in columns:
+                offset = column - first
+                value = row[offset] if offset < len(row) else None
+                data[column].append(value)
+                if value is not None:
+                    filled = len(data[column])
+    finally:
+        workbook.close()
+
+    # Like pd.read_excel, rows after the last filled one are dropped
+    return pd.DataFrame({column: values[:filled] for column, values in data.items()})
+
+
+def _read_columns_calamine(path, columns, sheet_name, skiprows) -> pd.DataFrame:
+    df = pd.read_excel(path, sheet_name=sheet_name, skiprows=skiprows, usecols=list(columns), engine='calamine')
+    df.columns = list(columns)
+    return df
+
+
+def read_columns(path, columns, sheet_name='Fest', skiprows=2) -> pd.DataFrame:
+    """Only the given 0-based columns of the sheet, labelled by their position.
+
+    Rows and index are those of pd.read_excel(path, sheet_name, skiprows),
+    so df[3] is df.iloc[:, 3] of a full read. Backed by a Parquet copy of
+    just these columns.
+    """
+    columns = tuple(sorted(set(columns)))
+
+    def parse():
+        if excel_engine() == 'calamine':
+            try:
+                return _read_columns_calamine(path, columns, sheet_name, skiprows)
+            except ValueError:
+                # e.g. a column beyond the sheet's last one
+                pass
+        return _stream_columns(path, columns, sheet_name, skiprows)
+
+    name = f"{sheet_name}-{skiprows}-c{'_'.join(map(str, columns))}"
+    return _cached(path, name, parse)
+
+
+class ExcelTailReader:
+    """Keep track of the last non-empty value of some columns of a workbook.
+
+    The workbooks normally only grow at the bottom, so the reader remembers
+    the file's mtime/size and the sheet's last filled row. An unchanged file
+    costs a single os.stat(), a changed file is parsed from that row on
+    (it may still be completed, e.g. gas entered after electricity).
+    Columns that stopped earlier keep their value until a new one appears.
+    If a value of that row was changed or cleared, or the sheet now ends
+    before it, rows were edited or removed even though the file may not
+    have shrunk, and the reader starts over from the whole sheet. The first
+    read is served from the Parquet copy of the columns (see read_columns).
+    """
+
+    def __init__(self, path, columns, sheet_name='Fest'):
+        self.path = path
+        self.columns = tuple(columns)  # 0-based positions, as used with iloc
+        self.sheet_name = sheet_name
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._stat = None
+        self._next_row = FIRST_DATA_ROW  # Last filled row, the next read starts there
+        self._last_values = {}
+        self._last_rows = {}  # column -> row of its last value
+
+    def last_values(self) -> dict:
+        """Return {column: last non-empty value}, parsing only new rows"""
+        with self._lock:
+            stat = os.stat(self.path)
+            key = (stat.st_mtime_ns, stat.st_size)
+            count_cache('tail_reader', hit=key == self._stat)
+            if key == self._stat:
+                return dict(self._last_values)
+
+            if self._stat is not None and stat.st_size < self._stat[1]:
+                # The workbook shrank, so rows were removed: start over
+                self._reset()
+
+            if self._stat is None:
+                self._read_cached_sheet()
+            elif not self._read_rows(self._next_row):
+                # The rows already read were changed: start over
+                self._reset()
+                self._read_cached_sheet()
+            # Store the stat taken *before* reading, so a write that happens
+            # while we parse is picked up by the next call
+            self._stat = key
+            return dict(self._last_values)
+
+    def _read_cached_sheet(self):
+        df = read_columns(self.path, self.columns, self.sheet_name)
+        last_row = None
+        for column in self.columns:
+            values = df[column].dropna()
+            if len(values):
+                self._last_values[column] = values.iloc[-1]
+                self._last_rows[column] = FIRST_DATA_ROW + int(values.index[-1])
+                last_row = max(last_row or 0, self._last_rows[column])
+
+        if last_row is not None:
+            self._next_row = last_row
+
+    def _read_rows(self, start_row) -> bool:
+        """Take the last values from start_row on; False if a last value read there changed"""
+        last_values, last_rows = dict(self._last_values), dict(self._last_rows)
+        checked = set()
+        workbook = openpyxl.load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            sheet = workbook[self.sheet_name]
+            first = min(self.columns)
+            rows = sheet.iter_rows(
+                min_row=start_row,
+                min_col=first + 1,
+                max_col=max(self.columns) + 1,
+                values_only=True
+            )
+            last_row = None
+            for row_number, row in enumerate(rows, start=start_row):
+                for column in self.columns:
+                    offset = column - first
+                    value = row[offset] if offset < len(row) else None
+                    if row_number == self._last_rows.get(column):
+                        if not _same_cell(value, self._last_values[column]):
+                            return False
+                        checked.add(column)
+                    if not is_missing(value):
+                        last_values[column] = value
+                        last_rows[column] = row_number
+                        last_row = row_number
+        finally:
+            workbook.close()
+
+        if checked != {column for column, row in self._last_rows.items() if row >= start_row}:
+            # The sheet now ends before start_row
+            return False
+        self._last_values, self._last_rows = last_values, last_rows
+
+        # Parse the last filled row again next time, it may still be
+        # completed (e.g. gas entered after electricity)
+        if last_row is not None:
+            self._next_row = last_row
+        return True
+
+
+def _same_cell(a, b) -> bool:
+    """Whether two cell values are equal, whichever reader they came from"""
+    try:
+        return bool(a == b)
+    except (TypeError, ValueError):
+        return False
+
+
+# Workbooks and meter columns, as configured in sites.toml
+REGISTRY = load_registry()
+
+# Source name -> workbook path
+EXCEL_PATHS = {name: source.path for name, source in REGISTRY.sources.items()}
+
+# Interval data of each meter: workbook, date column and energy column
+# (0-based, as used with iloc)
+METER_COLUMNS = {
+    meter.key: (meter.source, meter.date_column, meter.value_column) for meter in REGISTRY.meters.values()
+}
+
+logger = logging.getLogger(__name__)
+
+# One tail reader per workbook and process, shared by all sessions
+_tail_readers = {}
+_tail_readers_lock = threading.Lock()
+
+# The sources are loaded side by side, so one slow workbook doesn't hold up
+# the others and more sites don't make a load proportionally slower
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix='excel-source')
+# (task, source) -> load still running after its timeout; the next load
+# waits for it instead of starting another one on the same workbook
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def get_tail_reader(path, columns, sheet_name='Fest') -> ExcelTailReader:
+    with _tail_readers_lock:
+        key = (path, tuple(columns), sheet_name)
+        if key not in _tail_readers:
+            _tail_readers[key] = ExcelTailReader(path, columns, sheet_name)
+        return _tail_readers[key]
+
+
+def load_per_source(task: str, load: Callable[[Source], object]) -> Tuple[dict, dict]:
+    """Run load(source) for every source concurrently.
+
+    Returns ({source: result}, {source: error message}). A source that
+    raises or doesn't finish within its timeout is only reported in the
+    errors, the results of the others are kept.
+    """
+    sources = REGISTRY.sources
+    futures = {}
+    with _pending_lock:
+        for name, source in sources.items():
+            future = _pending.get((task, name))
+            if future is None:
+                future = _executor.submit(load, source)
+                _pending[(task, name)] = future
+            futures[name] = future
+
+    started = time.monotonic()
+    results, errors = {}, {}
+    for name, future in futures.items():
+        timeout = sources[name].timeout
+        try:
+            results[name] = future.result(max(0.0, timeout - (time.monotonic() - started)))
+        except concurrent.futures.TimeoutError:
+            errors[name] = f"{sources[name].path}: no data within {timeout:g}s"
+        except Exception as e:
+            errors[name] = str(e)
+
+    with _pending_lock:
+        for name, future in futures.items():
+            if future.done() and _pending.get((task, name)) is future:
+                del _pending[(task, name)]
+    return results, errors
+
+
+class MeterValues(NamedTuple):
+    values: Dict[str, float]  # meter -> latest reading
+    errors: Dict[str, str]  # source -> why its meters are missing
+
+
+def _latest_values(source: Source) -> dict:
+    meters = REGISTRY.meters_of(source.name)
+    columns = tuple(sorted({meter.value_column for meter in meters}))
+    last_values = get_tail_reader(source.path, columns, source.sheet).last_values()
+    # Meters without any reading yet (e.g. Pre-Fab gas) are left out
+    return {meter.key: last_values[meter.value_column] for meter in meters if meter.value_column in last_values}
+
+
+def load_excel_data() -> MeterValues:
+    """Load the latest meter values from the Excel files"""
+    results, errors = load_per_source('latest', _latest_values)
+    values = {}
+    for source_values in results.values():
+        values.update(source_values)
+    return MeterValues(values, errors)
+
+
+def _source_history(source: Source) -> dict:
+    if not os.path.exists(source.path):
+        return {}
+
+    meters = REGISTRY.meters_of(source.name)
+    columns = {column for meter in meters for column in (meter.date_column, meter.value_column)}
+    # skiprows=1 uses the real header row, so the first reading is kept
+    df = read_columns(source.path, columns, sheet_name=source.sheet, skiprows=1)
+    history = {}
+    for meter in meters:
+        dates = pd.to_datetime(df[meter.date_column], errors='coerce')
+        values = pd.to_numeric(df[meter.value_column], errors='coerce')
+        # Rows without a date are the summary cells below the readings
+        valid = dates.notna() & values.notna()
+        history[meter.key] = pd.Series(values[valid].to_numpy(float), index=dates[valid].to_numpy(), name=meter.key)
+    return history
+
+
+class MeterHistory(NamedTuple):
+    series: Dict[str, pd.Series]  # meter -> energy (kWh) indexed by reading date
+    errors: Dict[str, str]  # source -> why its meters are missing
+
+
+def load_meter_history() -> MeterHistory:
+    """History of all meters, by source as far as it loaded.
+
+    Meters of workbooks that don't exist (yet) are left out, those of
+    workbooks that failed to load too, with their source in the errors.
+    """
+    results, errors = load_per_source('history', _source_history)
+    for name, message in errors.items():
+        logger.warning("Meter history of %s not loaded: %s", name, message)
+
+    # In the order of the registry, whichever source finished first
+    history = {}
+    for meter in REGISTRY.meters:
+        for source_history in results.values():
+            if meter in source_history:
+                history[meter] = source_history[meter]
+    return MeterHistory(history, errors)
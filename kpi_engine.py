@@ -0,0 +1,90 @@
+"""Live KPIs of any number of meters.
+
+The energy data is turned into one (rows x meters) float matrix whose per-meter
+sums and counts are computed once when the data changes; only those are
+kept, the matrix is dropped again. A tick only scales
+those by the latest readings: mean(values * r / 100) == mean(values) * r / 100,
+so the per-tick work is one broadcast over the meters, however many rows
+the data has, and the source DataFrame is never modified.
+"""
+import threading
+from types import MappingProxyType
+from typing import Iterable, Mapping, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+# Columns of the energy data that aren't meters
+NON_METER_COLUMNS = ('id', 'timestamp')
+
+
+class Kpis(NamedTuple):
+    """Per-meter KPIs of one tick, arrays in the order of `meters`"""
+    meters: tuple
+    positions: Mapping[str, int]  # meter -> index into the arrays
+    averages: np.ndarray
+    sums: np.ndarray
+    deltas: np.ndarray  # averages minus those of the previous tick
+
+    def average(self, meter: str) -> float:
+        return float(self.averages[self.positions[meter]])
+
+    def sum(self, meter: str) -> float:
+        return float(self.sums[self.positions[meter]])
+
+    def delta(self, meter: str) -> float:
+        return float(self.deltas[self.positions[meter]])
+
+
+class KpiEngine:
+    """Scale the energy data of all meters by their latest readings"""
+
+    def __init__(self, frame: pd.DataFrame, meters: Optional[Iterable[str]] = None):
+        """meters: columns to use, default all numeric columns; missing ones have no data"""
+        if meters is None:
+            meters = [
+                column for column in frame.columns
+                if column not in NON_METER_COLUMNS and pd.api.types.is_numeric_dtype(frame[column])
+            ]
+        self.meters = tuple(meters)
+        self.positions = MappingProxyType({meter: i for i, meter in enumerate(self.meters)})
+        present = [meter for meter in self.meters if meter in frame.columns]
+
+        # One contiguous (rows x meters) matrix, NaN for gaps and missing meters
+        values = np.full((len(frame), len(self.meters)), np.nan)
+        if present:
+            columns = [self.positions[meter] for meter in present]
+            values[:, columns] = frame[present].to_numpy(dtype=np.float64, na_value=np.nan)
+        # Only the per-meter aggregates are kept, not the matrix
+
+        self.counts = np.count_nonzero(~np.isnan(values), axis=0)
+        self.sums = np.nansum(values, axis=0)
+        self.means = np.divide(self.sums, self.counts, out=np.zeros(len(self.meters)), where=self.counts > 0)
+
+    def readings_vector(self, readings: Mapping[str, float], default: float = 100.0) -> np.ndarray:
+        """The readings in the order of `meters`; 100 (unscaled) for meters without reading"""
+        return np.fromiter((readings.get(meter, default) for meter in self.meters), np.float64, len(self.meters))
+
+    def compute(self, readings: Mapping[str, float], previous: Optional[Kpis] = None) -> Kpis:
+        """KPIs for the latest readings, deltas against `previous` (zero without)"""
+        scale = self.readings_vector(readings) / 100
+        averages = self.means * scale
+        sums = self.sums * scale
+        if previous is not None and previous.meters == self.meters:
+            deltas = averages - previous.averages
+        else:
+            deltas = np.zeros(len(self.meters))
+        return Kpis(self.meters, self.positions, averages, sums, deltas)
+
+
+_cache = {'frame': None, 'meters': None, 'engine': None}
+_cache_lock = threading.Lock()
+
+
+def engine_for(frame: pd.DataFrame, meters: Optional[Iterable[str]] = None) -> KpiEngine:
+    """The engine of `frame`, only rebuilt when another frame (new energy data) comes in"""
+    meters = None if meters is None else tuple(meters)
+    with _cache_lock:
+        if _cache['frame'] is not frame or _cache['meters'] != meters:
+            _cache.update(frame=frame, meters=meters, engine=KpiEngine(frame, meters))
+        return _cache['engine']
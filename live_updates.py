@@ -0,0 +1,139 @@
+"""In-process publish/subscribe of the live meter readings.
+
+One ReadingsHub per server process polls the readings source and publishes
+a new version only when the readings actually changed. Pages don't poll
+the API themselves, but each session still checks the hub on its own
+fragment timer (st.fragment(run_every=...)): Streamlit can't push into a
+session from another thread. The check compares the hub's version with
+the one the session rendered last, and the KPIs are only recomputed when
+it moved on.
+
+subscribe() pushes to consumers in the server process itself, on every
+change or, like the anomaly detector that has to see a reading repeat to
+spot a flatline, on every poll. wait_for_change() is for consumers outside
+Streamlit.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from types import MappingProxyType
+from typing import Callable, Dict, Iterable, Mapping, Optional, Tuple
+
+import streamlit as st
+
+from energy_api import get_api_client
+from metrics import LOAD_ERRORS, LOAD_SECONDS
+
+# Seconds between two polls of the readings source
+POLL_SECONDS = float(os.environ.get('ENERGYBOARD_LIVE_POLL_SECONDS', 1))
+
+logger = logging.getLogger(__name__)
+
+
+class MockPublisher:
+    """Random readings around 100, to run the live view without any API"""
+
+    def __init__(self, meters: Iterable[str] = ('Halloeins', 'Hallozwei', 'Hallodrei'), seed=None):
+        self.meters = tuple(meters)
+        self._random = random.Random(seed)
+
+    def __call__(self) -> dict:
+        return {meter: self._random.uniform(80, 120) for meter in self.meters}
+
+
+class ReadingsHub:
+    """Poll a readings source for all viewers and publish what changed"""
+
+    def __init__(self, source: Callable[[], dict], interval: float = POLL_SECONDS):
+        self.source = source
+        self.interval = interval
+        self.error = None  # Message of the last failed poll, None once it works again
+        # Subscriber name -> message of its last failed callback, not a poll error
+        self.subscriber_errors: Dict[str, str] = {}
+        self._version = 0
+        self._readings = MappingProxyType({})
+        self._subscribers = []  # (callback, every_poll)
+        self._changed = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='readings-hub', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def latest(self) -> Tuple[int, Mapping[str, float]]:
+        """(version, readings) of the last published readings"""
+        return self._version, self._readings
+
+    def subscribe(self, callback: Callable[[int, Mapping[str, float]], None], every_poll: bool = False):
+        """Call callback(version, readings) on the hub's thread for every change.
+
+        every_poll: also for polls that returned the same readings again.
+        """
+        with self._changed:
+            self._subscribers.append((callback, every_poll))
+
+    def wait_for_change(self, version: int, timeout: Optional[float] = None) -> int:
+        """Block until the version differs from `version`; for consumers outside Streamlit"""
+        with self._changed:
+            self._changed.wait_for(lambda: self._version != version, timeout)
+            return self._version
+
+    def publish(self, readings: Mapping[str, float]) -> bool:
+        """Make `readings` the current readings, return whether anything changed"""
+        with self._changed:
+            changed = dict(readings) != dict(self._readings)
+            if changed:
+                self._readings = MappingProxyType(dict(readings))
+                self._version += 1
+                self._changed.notify_all()
+            version, current = self._version, self._readings
+            subscribers = [callback for callback, every_poll in self._subscribers if changed or every_poll]
+
+        for callback in subscribers:
+            self._notify(callback, version, current)
+        return changed
+
+    def _notify(self, callback, version: int, readings: Mapping[str, float]):
+        """Call one subscriber; its failure neither stops the others nor counts as a failed poll"""
+        name = getattr(callback, '__qualname__', repr(callback))
+        try:
+            callback(version, readings)
+            self.subscriber_errors.pop(name, None)
+        except Exception as e:
+            LOAD_ERRORS.labels(source='live_subscriber').inc()
+            logger.exception("Subscriber %s of the live readings failed", name)
+            self.subscriber_errors[name] = str(e)
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                with LOAD_SECONDS.labels(source='live_readings').time():
+                    readings = self.source()
+                self.error = None
+            except Exception as e:
+                LOAD_ERRORS.labels(source='live_readings').inc()
+                # Keep the last readings, the page shows the error
+                self.error = str(e)
+            else:
+                self.publish(readings)
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+
+@st.cache_resource
+def get_readings_hub() -> ReadingsHub:
+    """The hub shared by all sessions; ENERGYBOARD_LIVE_SOURCE=mock runs without the API"""
+    if os.environ.get('ENERGYBOARD_LIVE_SOURCE') == 'mock':
+        source = MockPublisher()
+    else:
+        source = get_api_client().next_readings
+    hub = ReadingsHub(source)
+    hub.start()
+    return hub
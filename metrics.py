@@ -0,0 +1,93 @@
+"""Prometheus metrics of the dashboard.
+
+The metrics are served on http://127.0.0.1:9464/metrics by default, see
+ENERGYBOARD_METRICS_ADDR / ENERGYBOARD_METRICS_PORT. Useful alerts:
+
+- energyboard_data_age_seconds: the workbooks stopped getting new readings
+- energyboard_load_errors_total: a source keeps failing to load
+"""
+import functools
+import logging
+import os
+import threading
+import time
+
+import streamlit as st
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+METRICS_ADDR = os.environ.get('ENERGYBOARD_METRICS_ADDR', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('ENERGYBOARD_METRICS_PORT', 9464))
+
+LOAD_SECONDS = Histogram(
+    'energyboard_load_seconds', 'Time spent loading a data source', ['source'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+)
+LOAD_ERRORS = Counter('energyboard_load_errors_total', 'Failed loads of a data source', ['source'])
+RENDER_SECONDS = Histogram(
+    'energyboard_render_seconds', 'Time spent rendering a dashboard section', ['section'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+)
+CACHE_REQUESTS = Counter(
+    'energyboard_cache_requests_total', 'Lookups of cached loaders by result (hit/miss)', ['loader', 'result']
+)
+DATA_AGE = Gauge('energyboard_data_age_seconds', 'Age of the newest reading of a meter', ['meter'])
+RESIDENT_BYTES = Gauge(
+    'energyboard_resident_bytes', 'Bytes of meter history held in memory or memory-mapped', ['component', 'storage']
+)
+
+logger = logging.getLogger(__name__)
+
+
+@st.cache_resource
+def start_metrics_server() -> bool:
+    """Serve /metrics once per process; False if the port is taken"""
+    try:
+        start_http_server(METRICS_PORT, addr=METRICS_ADDR)
+        return True
+    except OSError as e:
+        logger.warning("Metrics endpoint not started on %s:%s: %s", METRICS_ADDR, METRICS_PORT, e)
+        return False
+
+
+def render_timer(section: str):
+    """Context manager (or decorator) observing the render time of a dashboard section"""
+    return RENDER_SECONDS.labels(section=section).time()
+
+
+def count_cache(loader: str, hit: bool):
+    CACHE_REQUESTS.labels(loader=loader, result='hit' if hit else 'miss').inc()
+
+
+def tracked_cache_data(loader: str, **cache_kwargs):
+    """st.cache_data that also counts its hits and misses"""
+    def decorator(func):
+        # Set when the cached function actually runs, i.e. on a miss
+        computed = threading.local()
+
+        @functools.wraps(func)
+        def compute(*args, **kwargs):
+            computed.flag = True
+            return func(*args, **kwargs)
+
+        cached = st.cache_data(**cache_kwargs)(compute)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            computed.flag = False
+            result = cached(*args, **kwargs)
+            count_cache(loader, hit=not computed.flag)
+            return result
+
+        wrapper.clear = cached.clear
+        return wrapper
+
+    return decorator
+
+
+def set_data_age(meter: str, last_reading):
+    """Report the age of `meter`'s newest reading (naive local datetime) at every scrape"""
+    if hasattr(last_reading, 'to_pydatetime'):
+        # pd.Timestamp.timestamp() would take a naive time as UTC
+        last_reading = last_reading.to_pydatetime()
+    timestamp = last_reading.timestamp()
+    DATA_AGE.labels(meter=meter).set_function(lambda: time.time() - timestamp)
@@ -0,0 +1,272 @@
+"""Local stand-in for the json-server energy API, without Node.
+
+Serves the resources of api/db.json like `json-server --watch api/db.json`
+and adds what the dashboard needs for larger data:
+
+- GET /energy_data: also ?_page=&_limit= (with X-Total-Count and Link
+  headers, as json-server) and ?timestamp_gte=&timestamp_lte=
+- GET/PUT /latest_readings
+- GET /readings?meter=...&timestamp_gte=&timestamp_lte=: several meters at
+  once, one JSON array per meter instead of one object per reading
+- ETag/If-None-Match on every GET: unchanged data is answered with a 304
+- energy_data and readings as an Arrow IPC stream instead of JSON when the
+  client accepts application/vnd.apache.arrow.stream
+
+Run it from the command line:
+
+    python mock_api.py --db api/db.json --port 3000
+
+or in a background thread of a test or benchmark:
+
+    server = MockServer('api/db.json', port=0).start()
+    api = EnergyAPI(server.url)
+    ...
+    server.stop()
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import threading
+from typing import Optional
+from urllib.parse import urlencode
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import tornado.httpserver
+import tornado.netutil
+import tornado.web
+
+from energy_api import ARROW_STREAM
+
+DEFAULT_DB = 'api/db.json'
+
+
+class MockDatabase:
+    """The db.json resources; energy_data sorted by timestamp for range queries"""
+
+    def __init__(self, path: str = DEFAULT_DB):
+        with open(path) as f:
+            db = json.load(f)
+        frame = pd.DataFrame(db.get('energy_data', []))
+        if 'timestamp' in frame:
+            frame = frame.sort_values('timestamp', kind='stable').reset_index(drop=True)
+            self.timestamps = pd.to_datetime(frame['timestamp']).to_numpy()
+        else:
+            self.timestamps = np.array([], dtype='datetime64[ns]')
+        self.energy_data = frame
+        # Arrow copy with real timestamps; slices of it are zero-copy
+        arrow_frame = frame.copy()
+        if 'timestamp' in arrow_frame:
+            arrow_frame['timestamp'] = self.timestamps
+        self.energy_data_arrow = pa.Table.from_pandas(arrow_frame, preserve_index=False).replace_schema_metadata()
+        self.latest_readings = db.get('latest_readings', {})
+        # Bumped on every change of a resource, part of its ETags
+        self.versions = {'energy_data': 1, 'latest_readings': 1}
+        self.lock = threading.Lock()
+
+    def time_range(self, gte: Optional[str], lte: Optional[str]) -> slice:
+        """Rows of energy_data with gte <= timestamp <= lte"""
+        first = 0 if gte is None else np.searchsorted(self.timestamps, np.datetime64(pd.Timestamp(gte)), 'left')
+        stop = len(self.timestamps) if lte is None else np.searchsorted(
+            self.timestamps, np.datetime64(pd.Timestamp(lte)), 'right'
+        )
+        return slice(int(first), int(stop))
+
+    def put_latest_readings(self, readings: dict):
+        with self.lock:
+            self.latest_readings = readings
+            self.versions['latest_readings'] += 1
+
+
+class _Handler(tornado.web.RequestHandler):
+    resource = None
+
+    def initialize(self, db: MockDatabase):
+        self.db = db
+
+    def compute_etag(self):
+        # The resource's version, the query and the format, so a 304 needs no serialization
+        query = hashlib.sha1(self.request.uri.encode()).hexdigest()[:16]
+        return f'"{self.db.versions[self.resource]}-{query}{"-arrow" if self.wants_arrow() else ""}"'
+
+    def wants_arrow(self) -> bool:
+        return ARROW_STREAM in self.request.headers.get('Accept', '')
+
+    def not_modified(self) -> bool:
+        """Answer 304 if the client has the current version"""
+        self.set_header('Vary', 'Accept')
+        self.set_etag_header()
+        if self.check_etag_header():
+            self.set_status(304)
+            return True
+        return False
+
+    def write_json(self, body: str):
+        self.set_header('Content-Type', 'application/json; charset=utf-8')
+        self.write(body)
+
+    def write_arrow(self, table: pa.Table):
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        self.set_header('Content-Type', ARROW_STREAM)
+        self.write(sink.getvalue().to_pybytes())
+
+    def time_slice(self) -> slice:
+        try:
+            return self.db.time_range(self.get_query_argument('timestamp_gte', None),
+                                      self.get_query_argument('timestamp_lte', None))
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, f"Invalid timestamp: {e}")
+
+
+class EnergyDataHandler(_Handler):
+    resource = 'energy_data'
+
+    def get(self):
+        if self.not_modified():
+            return
+        rows = self.time_slice()
+        if self.get_query_argument('_page', None) is not None:
+            # json-server: 1-based pages of 10 rows unless _limit is given
+            try:
+                page = int(self.get_query_argument('_page'))
+                limit = int(self.get_query_argument('_limit', 10))
+            except ValueError:
+                raise tornado.web.HTTPError(400, "_page and _limit must be integers")
+            if page < 1 or limit < 1:
+                raise tornado.web.HTTPError(400, "_page and _limit must be positive")
+            total = rows.stop - rows.start
+            first = min(rows.start + (page - 1) * limit, rows.stop)
+            rows = slice(first, min(first + limit, rows.stop))
+            self.set_header('X-Total-Count', str(total))
+            self.set_header('Link', self._links(page, limit, total))
+        if self.wants_arrow():
+            self.write_arrow(self.db.energy_data_arrow.slice(rows.start, rows.stop - rows.start))
+        else:
+            # The C encoder of pandas instead of one dict per row
+            self.write_json(self.db.energy_data.iloc[rows].to_json(orient='records'))
+
+    def _links(self, page, limit, total) -> str:
+        last = max(1, -(-total // limit))
+        base = self.request.full_url().split('?')[0]
+        query = {k: v[-1].decode() for k, v in self.request.query_arguments.items()}
+        links = {'first': 1, 'prev': page - 1, 'next': page + 1, 'last': last}
+        return ', '.join(
+            f'<{base}?{urlencode({**query, "_page": number})}>; rel="{rel}"'
+            for rel, number in links.items() if 1 <= number <= last
+        )
+
+
+class LatestReadingsHandler(_Handler):
+    resource = 'latest_readings'
+
+    def get(self):
+        if not self.not_modified():
+            self.write_json(json.dumps(self.db.latest_readings))
+
+    def put(self):
+        try:
+            readings = json.loads(self.request.body)
+        except ValueError:
+            raise tornado.web.HTTPError(400, "Body is not JSON")
+        self.db.put_latest_readings(readings)
+        # Like json-server, answer with the stored resource
+        self.write_json(json.dumps(readings))
+
+
+class ReadingsHandler(_Handler):
+    """Bulk readings: {"timestamp": [...], "<meter>": [...], ...}"""
+    resource = 'energy_data'
+
+    def get(self):
+        if self.not_modified():
+            return
+        frame = self.db.energy_data
+        meters = self.get_query_arguments('meter') or [c for c in frame.columns if c not in ('id', 'timestamp')]
+        unknown = [meter for meter in meters if meter not in frame.columns]
+        if unknown:
+            raise tornado.web.HTTPError(404, f"Unknown meters: {', '.join(unknown)}")
+        rows = self.time_slice()
+        if self.wants_arrow():
+            table = self.db.energy_data_arrow.select(['timestamp'] + meters)
+            self.write_arrow(table.slice(rows.start, rows.stop - rows.start))
+            return
+        rows = frame.iloc[rows]
+        self.write_json('{' + ', '.join(
+            f'{json.dumps(column)}: {rows[column].to_json(orient="values")}' for column in ['timestamp'] + meters
+        ) + '}')
+
+
+def make_app(db: MockDatabase) -> tornado.web.Application:
+    return tornado.web.Application([
+        (r'/energy_data', EnergyDataHandler, {'db': db}),
+        (r'/latest_readings', LatestReadingsHandler, {'db': db}),
+        (r'/readings', ReadingsHandler, {'db': db}),
+    ])
+
+
+class MockServer:
+    """The mock API on its own event loop in a daemon thread"""
+
+    def __init__(self, db_path: str = DEFAULT_DB, port: int = 3000, address: str = '127.0.0.1'):
+        self.db = MockDatabase(db_path)
+        self.address = address
+        self.port = port
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.address}:{self.port}'
+
+    def start(self) -> 'MockServer':
+        """Start serving; port 0 picks a free port"""
+        sockets = tornado.netutil.bind_sockets(self.port, self.address)
+        self.port = sockets[0].getsockname()[1]
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._server = tornado.httpserver.HTTPServer(make_app(self.db))
+            self._server.add_sockets(sockets)
+            self._loop.call_soon(ready.set)
+            self._loop.run_forever()
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name='mock-api', daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._server.stop)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+
+
+async def serve(db_path: str, port: int, address: str):
+    server = tornado.httpserver.HTTPServer(make_app(MockDatabase(db_path)))
+    server.listen(port, address)
+    print(f"Serving {db_path} on http://{address}:{port}")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default=DEFAULT_DB)
+    parser.add_argument('--port', type=int, default=3000)
+    parser.add_argument('--address', default='127.0.0.1')
+    args = parser.parse_args()
+    asyncio.run(serve(args.db, args.port, args.address))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,27 @@
-import time  # to simulate a real time data, time loop
 from datetime import datetime
 
-import streamlit as st
-import pydeck as pdk
 import pandas as pd
-import numpy as np
-import random
+import streamlit as st
+from data_service import get_data_service
+from excel_reader import REGISTRY
+from metrics import start_metrics_server
+from pyramid import ALL_SITES, TIMELINE_POINTS, load_pyramids
+from rollups import MeterRollups, get_kpi_values, load_rollups
+
+start_metrics_server()
 
 st.title("Energieboard Zeitstrahl")
 
+# Pre-aggregated meter history, shared with the other pages and sessions
+data_service = get_data_service()
+data_service.register('rollups', load_rollups)
+# Multi-resolution pyramids of the same history, for the timeline
+data_service.register('pyramids', load_pyramids)
+snapshot = data_service.snapshot()
+if 'rollups' in snapshot.errors:
+    st.error(f"Error loading meter history: {snapshot.errors['rollups']}")
+rollups = snapshot.values.get('rollups') or MeterRollups({})
+
 # Create two columns for the timeline selector
 time_col1, time_col2 = st.columns([3, 1])
 
@@ -35,30 +48,11 @@ with time_col2:
             datetime(2023, 1, 1)
         )
 
-# Function to get KPI values based on time selection
-def get_kpi_values(time_selection):
-    # Here you would normally query your database or data source
-    # For this example, we'll generate random values
-    if isinstance(time_selection, tuple):
-        # For range selection
-        start, end = time_selection
-        days_diff = (end - start).days
-        multiplier = days_diff / 365  # Scale based on selected period
-    else:
-        # For specific date
-        multiplier = 1
-
-    return {
-        'energy': round(1000 * multiplier + random.uniform(-100, 100)),
-        'co2': round(500 * multiplier + random.uniform(-50, 50)),
-        'cost': round(2000 * multiplier + random.uniform(-200, 200))
-    }
-
 # Get KPI values based on selection
 if time_type == "Range":
-    kpi_values = get_kpi_values(selected_range)
+    kpi_values = get_kpi_values(rollups, selected_range)
 else:
-    kpi_values = get_kpi_values(selected_date)
+    kpi_values = get_kpi_values(rollups, selected_date)
 
 # Display KPIs in large format
 st.markdown("### Key Metrics for Selected Period")
@@ -68,19 +62,51 @@ with kpi_cols[0]:
     st.metric(
         label="Energieverbrauch in",
         value=f"{kpi_values['energy']:,} kWh",
-        delta=f"{round(kpi_values['energy'] * 0.1):,} kWh"
+        delta=f"{kpi_values['energy_delta']:,} kWh"
     )
 
 with kpi_cols[1]:
     st.metric(
         label="CO2 equivalent",
         value=f"{kpi_values['co2']:,} kg",
-        delta=f"{round(kpi_values['co2'] * 0.1):,} kg"
+        delta=f"{kpi_values['co2_delta']:,} kg"
     )
 
 with kpi_cols[2]:
     st.metric(
         label="Kosten",
         value=f"{kpi_values['cost']:,} €",
-        delta=f"{round(kpi_values['cost'] * 0.1):,} €"
-    )
\ No newline at end of file
+        delta=f"{kpi_values['cost_delta']:,} €"
+    )
+
+# Timeline of the selected period, served from the pyramid level that fits the chart width
+st.markdown("### Zeitstrahl")
+pyramids = snapshot.values.get('pyramids')
+if 'pyramids' in snapshot.errors:
+    st.error(f"Error loading the timeline: {snapshot.errors['pyramids']}")
+
+sites = {ALL_SITES: "Alle Standorte", **{site.key: site.name for site in REGISTRY.sites}}
+selected_site = st.selectbox("Standort", list(sites), format_func=sites.get)
+
+if time_type == "Range":
+    timeline_start, timeline_end = selected_range
+else:
+    timeline_start = timeline_end = selected_date
+# Whole days, the last one included
+timeline_start = pd.Timestamp(timeline_start).normalize()
+timeline_end = pd.Timestamp(timeline_end).normalize() + pd.Timedelta(days=1)
+
+if pyramids is None or selected_site not in pyramids.sites:
+    st.info("No meter history for the timeline yet")
+else:
+    window = pyramids.sites[selected_site].query(timeline_start, timeline_end, TIMELINE_POINTS)
+    if window.frame.empty:
+        st.info("No readings in the selected period")
+    else:
+        st.line_chart(
+            window.frame[['min', 'mean', 'max']].rename(columns={
+                'min': 'Minimum (kWh)', 'mean': 'Mittelwert (kWh)', 'max': 'Maximum (kWh)'
+            }),
+            color=['#9ecae1', '#08519c', '#9ecae1']
+        )
+        st.caption(f"{len(window.frame)} points, {window.level} resolution")
@@ -1,13 +1,13 @@
-import pandas as pd
 import streamlit as st
+from excel_reader import read_columns
 
 # Load the Excel file
 def get_last_values():
     try:
-        df = pd.read_excel('E_H.xlsx', sheet_name='Fest', skiprows=2)
+        df = read_columns('E_H.xlsx', [3], sheet_name='Fest', skiprows=2)  # Only column D, from its Parquet copy
         
         # Get last non-NaN value specifically from Column D
-        column_d = df.iloc[:, 3]  # Get Column D
+        column_d = df[3]  # Get Column D
         last_energy_value = column_d.dropna().iloc[-1]  # Get last non-NaN value
         last_energy_index = column_d.dropna().index[-1]  # Get its index
         
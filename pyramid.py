@@ -0,0 +1,227 @@
+"""Multi-resolution pyramid of meter series for the timeline.
+
+Every series is kept at five resolutions: the raw readings, then 15 min,
+hourly, daily and weekly buckets (weeks start on Monday). Each bucket holds
+the count, sum, min and max of the readings in it, so its mean is exact
+too. A level is computed from the next finer one (sums and counts add up,
+min of mins, max of maxes), not from the readings again.
+
+A query for a time window is answered from the coarsest level that still
+has about the requested number of points in it (the chart's width), so
+zooming out over years reads a few thousand daily or weekly buckets
+instead of millions of readings. The few buckets more than requested a level can
+return are merged into groups, again exactly.
+
+Sites get their own pyramid, built on the 15 min totals of their meters:
+the min and max of a site's hour are those of its 15 min load.
+
+The readings come from the storage backend (storage.py), the same import
+the rollups and KPIs are computed from.
+"""
+import logging
+import os
+import threading
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from excel_reader import REGISTRY
+from metrics import count_cache
+from rollups import history_key, stored_history
+
+# (name, bucket width), finest first; None for the readings themselves
+LEVELS = (
+    ('raw', None),
+    ('15min', pd.Timedelta(minutes=15)),
+    ('hourly', pd.Timedelta(hours=1)),
+    ('daily', pd.Timedelta(days=1)),
+    ('weekly', pd.Timedelta(weeks=1)),
+)
+# Weekly buckets start on Mondays, 1970-01-05 is the first after the epoch
+WEEK_ORIGIN = pd.Timestamp('1970-01-05').value
+# Points per timeline chart, about its width in pixels
+TIMELINE_POINTS = int(os.environ.get('ENERGYBOARD_TIMELINE_POINTS', 1000))
+# Key of the pyramid of all sites together
+ALL_SITES = ''
+
+logger = logging.getLogger(__name__)
+
+
+class Level(NamedTuple):
+    """Buckets of one resolution, sorted by their start"""
+    name: str
+    width: Optional[pd.Timedelta]
+    times: np.ndarray  # int64, bucket start in ns since the epoch
+    counts: np.ndarray  # int32, readings per bucket
+    sums: np.ndarray  # float64
+    mins: np.ndarray  # float32
+    maxs: np.ndarray  # float32
+
+    def floor(self, times: np.ndarray) -> np.ndarray:
+        """Start of the buckets the times (ns) fall into"""
+        if self.width is None:
+            return times
+        width = self.width.value
+        origin = WEEK_ORIGIN if self.width == pd.Timedelta(weeks=1) else 0
+        return (times - origin) // width * width + origin
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (self.times, self.counts, self.sums, self.mins, self.maxs))
+
+
+def _bucket_starts(keys: np.ndarray) -> np.ndarray:
+    """Positions where the (sorted) bucket keys change, starting with 0"""
+    if not len(keys):
+        return np.array([], dtype=np.int64)
+    return np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+
+
+def _coarsen(level: Level, name: str, width: pd.Timedelta) -> Level:
+    """`level` aggregated into buckets of `width`"""
+    coarse = Level(name, width, level.times[:0], level.counts[:0], level.sums[:0], level.mins[:0], level.maxs[:0])
+    keys = coarse.floor(level.times)
+    starts = _bucket_starts(keys)
+    if not len(starts):
+        return coarse
+    return coarse._replace(
+        times=keys[starts],
+        counts=np.add.reduceat(level.counts, starts),
+        sums=np.add.reduceat(level.sums, starts),
+        mins=np.minimum.reduceat(level.mins, starts),
+        maxs=np.maximum.reduceat(level.maxs, starts),
+    )
+
+
+class Window(NamedTuple):
+    """Result of a query: the level it was served from and its buckets"""
+    level: str
+    frame: pd.DataFrame  # index time; mean, min, max, sum, count
+
+
+class TimePyramid:
+    """One series at all resolutions of LEVELS"""
+
+    def __init__(self, times: np.ndarray, values: np.ndarray, levels: Sequence[Tuple] = LEVELS):
+        """times: sorted int64 ns; values: the readings. levels[0] is the resolution of the readings"""
+        values = np.asarray(values, dtype=np.float64)
+        name, width = levels[0]
+        # The finest level is the readings: one per bucket, sum == min == max
+        extremes = values.astype(np.float32)
+        finest = Level(
+            name, width, np.asarray(times, dtype=np.int64), np.ones(len(values), dtype=np.int32),
+            values, extremes, extremes
+        )
+        self.levels = [finest]
+        for name, width in levels[1:]:
+            self.levels.append(_coarsen(self.levels[-1], name, width))
+
+    @classmethod
+    def from_series(cls, series: pd.Series, levels: Sequence[Tuple] = LEVELS) -> 'TimePyramid':
+        """Pyramid of a Series indexed by time; NaN readings are left out"""
+        series = series.dropna().sort_index(kind='stable')
+        return cls(pd.DatetimeIndex(series.index).asi8, series.to_numpy(np.float64), levels)
+
+    def level(self, name: str) -> Level:
+        return next(level for level in self.levels if level.name == name)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(level.nbytes for level in self.levels)
+
+    def _range(self, level: Level, start: int, end: int) -> Tuple[int, int]:
+        """Positions of the buckets overlapping [start, end) ns"""
+        lo = np.searchsorted(level.times, level.floor(np.int64(start)), side='left')
+        hi = np.searchsorted(level.times, end, side='left')
+        return int(lo), int(hi)
+
+    def query(self, start, end, points: int = TIMELINE_POINTS) -> Window:
+        """Buckets of [start, end) from the coarsest level with at least `points` of them.
+
+        If even the readings are fewer, those are returned. Levels with more
+        than `points` buckets in the window are merged into groups of
+        consecutive buckets, so at most `points` come back.
+        """
+        start, end = pd.Timestamp(start).value, pd.Timestamp(end).value
+        for level in reversed(self.levels):
+            lo, hi = self._range(level, start, end)
+            if hi - lo >= points or level is self.levels[0]:
+                break
+
+        group = max(1, -(-(hi - lo) // max(points, 1)))
+        starts = np.arange(lo, hi, group)
+        if group == 1:
+            times, counts, sums = level.times[lo:hi], level.counts[lo:hi], level.sums[lo:hi]
+            mins, maxs = level.mins[lo:hi], level.maxs[lo:hi]
+        elif len(starts):
+            times, counts = level.times[starts], np.add.reduceat(level.counts[:hi], starts)
+            sums = np.add.reduceat(level.sums[:hi], starts)
+            mins, maxs = np.minimum.reduceat(level.mins[:hi], starts), np.maximum.reduceat(level.maxs[:hi], starts)
+        else:
+            times, counts, sums, mins, maxs = (a[:0] for a in (level.times, level.counts, level.sums,
+                                                                level.mins, level.maxs))
+
+        frame = pd.DataFrame({
+            'mean': sums / np.maximum(counts, 1),
+            'min': mins,
+            'max': maxs,
+            'sum': sums,
+            'count': counts,
+        }, index=pd.DatetimeIndex(times.view('datetime64[ns]'), name='time'))
+        return Window(level.name, frame)
+
+
+def total_pyramid(pyramids: Sequence[TimePyramid]) -> TimePyramid:
+    """Pyramid of the 15 min totals of several pyramids"""
+    quarters = [pyramid.level('15min') for pyramid in pyramids]
+    times = np.concatenate([level.times for level in quarters]) if quarters else np.array([], dtype=np.int64)
+    sums = np.concatenate([level.sums for level in quarters]) if quarters else np.array([])
+    order = np.argsort(times, kind='stable')
+    times, sums = times[order], sums[order]
+    starts = _bucket_starts(times)
+    return TimePyramid(times[starts], np.add.reduceat(sums, starts) if len(starts) else sums, LEVELS[1:])
+
+
+class Pyramids(NamedTuple):
+    """Pyramids of the meters and of the sites (ALL_SITES for all of them)"""
+    meters: Dict[str, TimePyramid]
+    sites: Dict[str, TimePyramid]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(pyramid.nbytes for pyramid in (*self.meters.values(), *self.sites.values()))
+
+
+def build_pyramids(readings: pd.DataFrame) -> Pyramids:
+    """Pyramids of the energy of stored readings (columns meter, ts, energy) and of the registry's sites"""
+    meters = {}
+    for name, rows in readings.groupby('meter', sort=False):
+        # Stored by meter then time, so already sorted
+        meters[name] = TimePyramid(pd.DatetimeIndex(rows['ts']).asi8, rows['energy'].to_numpy(np.float64))
+    sites = {
+        site.key: total_pyramid([meters[meter.key] for meter in site.meters if meter.key in meters])
+        for site in REGISTRY.sites
+    }
+    sites[ALL_SITES] = total_pyramid(list(meters.values()))
+    return Pyramids(meters, sites)
+
+
+# Pyramids of the stored history, rebuilt when a workbook or tariff changes
+_cache = {'key': None, 'pyramids': None}
+_cache_lock = threading.Lock()
+
+
+def load_pyramids() -> Pyramids:
+    """Pyramids of the stored meter history; unchanged workbooks return the same object"""
+    key = history_key()
+    with _cache_lock:
+        count_cache('pyramids', hit=key == _cache['key'])
+        if key != _cache['key']:
+            readings = stored_history().readings(meters=list(REGISTRY.meters))
+            pyramids = build_pyramids(readings)
+            logger.info("Built the timeline pyramids of %d meters, %.1f MB", len(pyramids.meters),
+                        pyramids.nbytes / 2 ** 20)
+            _cache['pyramids'] = pyramids
+            _cache['key'] = key
+        return _cache['pyramids']
@@ -0,0 +1,153 @@
+"""Typed view of sites.toml: the sites, their meters and the data sources"""
+import functools
+import os
+from types import MappingProxyType
+from typing import Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    tomllib = None
+    import toml
+
+REGISTRY_PATH = os.environ.get(
+    'ENERGYBOARD_SITES', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sites.toml')
+)
+
+
+class Source(NamedTuple):
+    """A workbook with meter readings"""
+    name: str
+    path: str
+    sheet: str = 'Fest'
+    timeout: float = 10.0  # Seconds a load may take before its meters count as failed
+
+
+class Meter(NamedTuple):
+    key: str
+    site: str
+    source: str
+    date_column: int
+    value_column: int
+    carrier: str = 'electricity'
+
+
+class Carrier(NamedTuple):
+    """Price and emission tables (CSV paths, '' for none) of an energy carrier"""
+    name: str
+    price: str = ''
+    co2: str = ''
+
+
+class Marker(NamedTuple):
+    name: str
+    lat: float
+    lon: float
+
+
+class Site(NamedTuple):
+    key: str
+    name: str
+    color: str
+    hover_color: str
+    chart_color: str
+    marker_color: Tuple[int, int, int]
+    markers: Tuple[Marker, ...]
+    meters: Tuple[Meter, ...]
+    chart_title: str
+
+
+class Tile(NamedTuple):
+    label: str
+    meter: Optional[str] = None
+
+
+class MapView(NamedTuple):
+    latitude: float
+    longitude: float
+    zoom: float
+
+
+class Registry(NamedTuple):
+    map: MapView
+    sources: Dict[str, Source]
+    sites: Tuple[Site, ...]
+    tiles: Tuple[Tile, ...]
+    carriers: Dict[str, Carrier]
+    meters: Mapping[str, Meter]  # All meters by key, in site order
+
+    def meters_of(self, source: str) -> List[Meter]:
+        return [meter for meter in self.meters.values() if meter.source == source]
+
+
+def _read_toml(path) -> dict:
+    if tomllib is not None:
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    with open(path, encoding='utf-8') as f:
+        return toml.load(f)
+
+
+def parse_registry(config: dict, base_dir: str = '.') -> Registry:
+    """Registry of a parsed sites.toml; ValueError if it is inconsistent.
+
+    Workbook and tariff paths are relative to base_dir, the directory of sites.toml.
+    """
+    carriers = {
+        name: Carrier(name, *(os.path.join(base_dir, entry[table]) if entry.get(table) else ''
+                              for table in ('price', 'co2')))
+        for name, entry in config.get('carriers', {}).items()
+    }
+    sources = {
+        name: Source(name, os.path.join(base_dir, entry['path']), entry.get('sheet', 'Fest'),
+                     float(entry.get('timeout', 10)))
+        for name, entry in config.get('sources', {}).items()
+    }
+
+    sites = []
+    for entry in config.get('sites', []):
+        meters = tuple(
+            Meter(meter['key'], entry['key'], meter['source'], int(meter['date_column']), int(meter['value_column']),
+                  meter.get('carrier', 'electricity'))
+            for meter in entry.get('meters', [])
+        )
+        for meter in meters:
+            if meter.source not in sources:
+                raise ValueError(f"Meter {meter.key} of site {entry['key']} uses unknown source {meter.source}")
+            if carriers and meter.carrier not in carriers:
+                raise ValueError(f"Meter {meter.key} of site {entry['key']} uses unknown carrier {meter.carrier}")
+        sites.append(Site(
+            key=entry['key'],
+            name=entry['name'],
+            color=entry['color'],
+            hover_color=entry.get('hover_color', entry['color']),
+            chart_color=entry.get('chart_color', entry['color']),
+            marker_color=tuple(entry.get('marker_color', (0, 42, 59))),
+            markers=tuple(Marker(marker['name'], float(marker['lat']), float(marker['lon']))
+                          for marker in entry.get('markers', [])),
+            meters=meters,
+            chart_title=entry.get('chart_title', entry['name'])
+        ))
+
+    keys = [meter.key for site in sites for meter in site.meters]
+    duplicates = sorted({key for key in keys if keys.count(key) > 1})
+    if duplicates:
+        raise ValueError(f"Meters defined more than once: {', '.join(duplicates)}")
+
+    tiles = tuple(Tile(tile['label'], tile.get('meter')) for tile in config.get('tiles', []))
+    for tile in tiles:
+        if tile.meter is not None and tile.meter not in keys:
+            raise ValueError(f"Tile {tile.label} shows unknown meter {tile.meter}")
+
+    view = config.get('map', {})
+    return Registry(
+        MapView(float(view.get('latitude', 0)), float(view.get('longitude', 0)), float(view.get('zoom', 12))),
+        sources, tuple(sites), tiles, carriers,
+        MappingProxyType({meter.key: meter for site in sites for meter in site.meters})
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def load_registry(path: str = REGISTRY_PATH) -> Registry:
+    """The registry of `path`, read once per process"""
+    return parse_registry(_read_toml(path), os.path.dirname(os.path.abspath(path)))
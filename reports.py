@@ -0,0 +1,278 @@
+"""PDF and PowerPoint reports of the dashboard, rendered in the background.
+
+A report covers a date range: the KPI tiles, the key metrics of the
+range, the energy distribution and a consumption chart per site. Reports
+are rendered by a small worker pool shared by all sessions. A session
+only submits a ReportRequest and then polls the job's progress, so a
+monthly report never blocks the page of anyone watching the dashboard.
+
+Finished reports are kept per (range, format, data version): asking for
+the same report again, from any session, returns the same job until the
+data changes.
+"""
+import collections
+import concurrent.futures
+import datetime
+import io
+import logging
+import os
+import threading
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+import pandas as pd
+import streamlit as st
+
+from charts import draw_consumption_chart, draw_distribution_chart
+from data_service import Snapshot
+from excel_reader import MeterValues
+from metrics import LOAD_ERRORS, LOAD_SECONDS
+from registry import Registry, load_registry
+from rollups import MeterRollups, get_kpi_values
+
+# Parallel report renders; more only compete with the dashboard for the CPU
+REPORT_WORKERS = int(os.environ.get('ENERGYBOARD_REPORT_WORKERS', 1))
+# Finished reports kept for download
+REPORT_CACHE_SIZE = int(os.environ.get('ENERGYBOARD_REPORT_CACHE_SIZE', 16))
+
+# format -> (file extension, MIME type)
+REPORT_FORMATS = {
+    'PDF': ('pdf', 'application/pdf'),
+    'PowerPoint': ('pptx', 'application/vnd.openxmlformats-officedocument.presentationml.presentation'),
+}
+
+logger = logging.getLogger(__name__)
+
+
+class ReportRequest(NamedTuple):
+    start: datetime.date
+    end: datetime.date
+    format: str  # Key of REPORT_FORMATS
+
+
+class Chart(NamedTuple):
+    title: str
+    png: bytes
+
+
+class ReportContent(NamedTuple):
+    """Everything a report shows, independent of its format"""
+    title: str
+    subtitle: str
+    tiles: List[Tuple[str, str]]  # (label, value)
+    metrics: List[Tuple[str, str, str]]  # (label, value, delta)
+    charts: List[Chart]
+
+
+class ReportJob:
+    """State of one report; written by its worker, read by the sessions"""
+
+    def __init__(self, request: ReportRequest, version: int):
+        self.request = request
+        self.version = version
+        self.state = 'queued'  # queued, running, done or failed
+        self.progress = 0.0
+        self.step = 'Waiting for a worker'
+        self.data: Optional[bytes] = None
+        self.error: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ('done', 'failed')
+
+    @property
+    def file_name(self) -> str:
+        extension = REPORT_FORMATS[self.request.format][0]
+        return f"energyboard_{self.request.start:%Y%m%d}-{self.request.end:%Y%m%d}.{extension}"
+
+    @property
+    def mime(self) -> str:
+        return REPORT_FORMATS[self.request.format][1]
+
+    def report_progress(self, progress: float, step: str):
+        self.progress, self.step = progress, step
+
+
+def collect_content(request: ReportRequest, snapshot: Snapshot, registry: Registry,
+                    report: Callable[[float, str], None]) -> ReportContent:
+    """Numbers and chart images of a report"""
+    start, end = pd.Timestamp(request.start), pd.Timestamp(request.end)
+    rollups = snapshot.values.get('rollups') or MeterRollups({})
+    values = snapshot.values.get('excel') or MeterValues({}, {})
+
+    report(0.05, 'Collecting the key figures')
+    tiles = [
+        (tile.label, f"{round(values.values.get(tile.meter, 0)) if tile.meter else 0} kWh")
+        for tile in registry.tiles
+    ]
+    kpis = get_kpi_values(rollups, (start, end))
+    metrics = [
+        ('Energieverbrauch', f"{kpis['energy']:,} kWh", f"{kpis['energy_delta']:+,} kWh"),
+        ('CO2 equivalent', f"{kpis['co2']:,} kg", f"{kpis['co2_delta']:+,} kg"),
+        ('Kosten', f"{kpis['cost']:,} EUR", f"{kpis['cost_delta']:+,} EUR"),
+    ]
+
+    # Consumption per site within the range
+    totals = rollups.meter_totals(start, end)
+    site_totals = [
+        (site, sum(totals[rollups.meters.index(meter.key)] for meter in site.meters if meter.key in rollups.meters))
+        for site in registry.sites
+    ]
+    charts = []
+    shares = [(site, total) for site, total in site_totals if total > 0]
+    if shares:
+        report(0.15, 'Drawing the energy distribution')
+        charts.append(Chart('Energy Distribution', draw_distribution_chart(
+            [site.name for site, _ in shares], [round(total, 3) for _, total in shares],
+            [site.chart_color for site, _ in shares], background='white', text_color='black'
+        )))
+
+    # One chart per site with readings: daily for up to three months, else monthly
+    daily = rollups.daily.loc[start:end]
+    monthly = daily.resample('MS').sum()
+    sites = [site for site, total in site_totals if any(meter.key in rollups.meters for meter in site.meters)]
+    for i, site in enumerate(sites):
+        report(0.2 + 0.6 * i / len(sites), f"Drawing the chart of {site.name}")
+        columns = [meter.key for meter in site.meters if meter.key in rollups.meters]
+        if (end - start).days <= 92:
+            series, kind, unit = daily[columns].sum(axis=1), 'line', 'daily'
+        else:
+            series, kind, unit = monthly[columns].sum(axis=1), 'bar', 'monthly'
+        title = f"{site.chart_title} Energy Consumption ({unit})"
+        charts.append(Chart(title, draw_consumption_chart(title, series, site.chart_color, kind)))
+
+    return ReportContent(
+        'Energy Board FFB',
+        f"{request.start:%d.%m.%Y} - {request.end:%d.%m.%Y}, created {datetime.datetime.now():%d.%m.%Y %H:%M}",
+        tiles, metrics, charts
+    )
+
+
+def render_pdf(content: ReportContent) -> bytes:
+    # Only needed for PDF reports
+    from fpdf import FPDF
+
+    pdf = FPDF(orientation='landscape')
+    pdf.set_auto_page_break(True, margin=15)
+    pdf.add_page()
+    pdf.set_font('helvetica', 'B', 24)
+    pdf.cell(0, 14, content.title, new_x='LMARGIN', new_y='NEXT')
+    pdf.set_font('helvetica', '', 12)
+    pdf.cell(0, 8, content.subtitle, new_x='LMARGIN', new_y='NEXT')
+    pdf.ln(6)
+
+    # The tiles, three per row, then the metrics of the range
+    width = (pdf.w - pdf.l_margin - pdf.r_margin) / 3
+    for rows, heading in ((content.tiles, 'Current values'), (content.metrics, 'Key metrics for the period')):
+        pdf.set_font('helvetica', 'B', 14)
+        pdf.cell(0, 10, heading, new_x='LMARGIN', new_y='NEXT')
+        for row_start in range(0, len(rows), 3):
+            for label, value, *delta in rows[row_start:row_start + 3]:
+                x, y = pdf.get_x(), pdf.get_y()
+                pdf.set_font('helvetica', '', 10)
+                pdf.cell(width, 6, label, new_x='LEFT', new_y='NEXT')
+                pdf.set_font('helvetica', 'B', 16)
+                pdf.cell(width, 9, value + (f"  ({delta[0]})" if delta else ''))
+                pdf.set_xy(x + width, y)
+            pdf.set_xy(pdf.l_margin, pdf.get_y() + 17)
+        pdf.ln(4)
+
+    for chart in content.charts:
+        pdf.add_page()
+        pdf.set_font('helvetica', 'B', 14)
+        pdf.cell(0, 10, chart.title, new_x='LMARGIN', new_y='NEXT')
+        pdf.image(io.BytesIO(chart.png), w=pdf.w - pdf.l_margin - pdf.r_margin - 40)
+    return bytes(pdf.output())
+
+
+def render_pptx(content: ReportContent) -> bytes:
+    # Only needed for PowerPoint reports
+    from pptx import Presentation
+    from pptx.util import Inches, Pt
+
+    presentation = Presentation()
+
+    slide = presentation.slides.add_slide(presentation.slide_layouts[0])
+    slide.shapes.title.text = content.title
+    slide.placeholders[1].text = content.subtitle
+
+    for rows, heading in ((content.tiles, 'Current values'), (content.metrics, 'Key metrics for the period')):
+        slide = presentation.slides.add_slide(presentation.slide_layouts[5])
+        slide.shapes.title.text = heading
+        table = slide.shapes.add_table(
+            len(rows) + 1, 3, Inches(0.5), Inches(1.8), Inches(9), Inches(0.5) * (len(rows) + 1)
+        ).table
+        for column, name in enumerate(('', 'Value', 'Change' if rows is content.metrics else '')):
+            table.cell(0, column).text = name
+        for row, (label, value, *delta) in enumerate(rows, start=1):
+            for column, text in enumerate((label, value, delta[0] if delta else '')):
+                table.cell(row, column).text = text
+                table.cell(row, column).text_frame.paragraphs[0].font.size = Pt(16)
+
+    for chart in content.charts:
+        slide = presentation.slides.add_slide(presentation.slide_layouts[5])
+        slide.shapes.title.text = chart.title
+        slide.shapes.add_picture(io.BytesIO(chart.png), Inches(0.5), Inches(1.6), width=Inches(9))
+
+    buffer = io.BytesIO()
+    presentation.save(buffer)
+    return buffer.getvalue()
+
+
+RENDERERS = {'PDF': render_pdf, 'PowerPoint': render_pptx}
+
+
+class ReportService:
+    """Worker pool rendering reports, with the finished ones cached"""
+
+    def __init__(self, workers: int = REPORT_WORKERS, cache_size: int = REPORT_CACHE_SIZE,
+                 registry: Optional[Registry] = None):
+        self.registry = registry or load_registry()
+        self.cache_size = cache_size
+        # The executor's queue is the job queue; jobs wait there for a worker
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='report')
+        self._jobs = collections.OrderedDict()  # (request, version) -> ReportJob
+        self._lock = threading.Lock()
+
+    def submit(self, request: ReportRequest, snapshot: Snapshot) -> ReportJob:
+        """The job of a report of the snapshot's data, queued unless it exists already"""
+        if request.format not in RENDERERS:
+            raise ValueError(f"Unknown report format {request.format!r}")
+        key = (request, snapshot.version)
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job.state != 'failed':
+                self._jobs.move_to_end(key)
+                return job
+            job = self._jobs[key] = ReportJob(request, snapshot.version)
+            self._evict()
+        self._executor.submit(self._run, job, snapshot)
+        return job
+
+    def _evict(self):
+        """Forget the oldest finished reports beyond the cache size"""
+        finished = [key for key, job in self._jobs.items() if job.finished]
+        for key in finished[:max(0, len(self._jobs) - self.cache_size)]:
+            del self._jobs[key]
+
+    def _run(self, job: ReportJob, snapshot: Snapshot):
+        job.state = 'running'
+        try:
+            with LOAD_SECONDS.labels(source='report').time():
+                content = collect_content(job.request, snapshot, self.registry, job.report_progress)
+                job.report_progress(0.85, f"Writing the {job.request.format} file")
+                job.data = RENDERERS[job.request.format](content)
+            job.report_progress(1.0, 'Done')
+            job.state = 'done'
+        except Exception as e:
+            LOAD_ERRORS.labels(source='report').inc()
+            logger.exception("Report %s failed", job.file_name)
+            job.error = str(e)
+            job.state = 'failed'
+        with self._lock:
+            self._evict()
+
+
+@st.cache_resource
+def get_report_service() -> ReportService:
+    """The report workers shared by all sessions"""
+    return ReportService()
@@ -0,0 +1,253 @@
+"""Pre-aggregated meter consumption, cost and CO2 for the time-period KPIs"""
+import datetime
+import hashlib
+import logging
+import os
+import threading
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from compact_store import MeterStore, memory_budget
+from excel_reader import EXCEL_PATHS, REGISTRY, content_hash, load_meter_history
+from metrics import count_cache, set_data_age
+from storage import QUANTITIES, StorageBackend, get_storage
+from tariffs import Tariffs, load_tariffs, tariff_files
+
+logger = logging.getLogger(__name__)
+
+
+def price_series(series: Dict[str, pd.Series], tariffs: Tariffs, carriers: Dict[str, str]) -> Dict[str, Dict]:
+    """{quantity: {meter: Series}} of the readings, their cost and their CO2"""
+    priced = {quantity: {} for quantity in QUANTITIES}
+    for name, s in series.items():
+        energy = s.groupby(level=0).sum()
+        if not isinstance(energy.index, pd.DatetimeIndex):
+            energy.index = pd.to_datetime(energy.index)
+        priced['energy'][name] = energy
+        priced['cost'][name], priced['co2'][name] = tariffs.apply(energy, carriers.get(name, 'electricity'))
+    return priced
+
+
+class MeterRollups:
+    """Hourly/daily/monthly sums per meter and prefix sums over the days.
+
+    The hourly sums are a compact MeterStore holding only the hours with
+    readings; daily and monthly sums are float32 frames. The prefix sums
+    stay float64, so long ranges add up exactly.
+
+    The daily sums are stored on a dense day grid starting at `origin`,
+    together with their cumulative sums, so the total of any range of whole
+    days is prefix[end + 1] - prefix[start]: two array lookups, however long
+    the history is.
+
+    Cost and CO2 are priced per reading with the rate valid at its time
+    (see tariffs.py) before they are summed, so tariff changes within a
+    range are accounted for and the KPIs stay the same prefix lookup.
+    """
+
+    def __init__(self, series: Dict[str, pd.Series], tariffs: Optional[Tariffs] = None,
+                 carriers: Optional[Dict[str, str]] = None):
+        priced = price_series(series, tariffs or Tariffs({}, {}), carriers or {})
+        frames = {quantity: pd.DataFrame(columns) for quantity, columns in priced.items()}
+        self._build(
+            tuple(series), frames, {name: s.index.max() for name, s in series.items() if len(s)},
+            MeterStore.from_series({
+                name: energy.groupby(energy.index.floor('h')).sum() for name, energy in priced['energy'].items()
+            })
+        )
+
+    @classmethod
+    def from_store(cls, store: StorageBackend, meters: Iterable[str],
+                   sites: Optional[Dict[str, str]] = None) -> 'MeterRollups':
+        """Rollups of the hourly and daily sums the storage backend aggregates"""
+        meters = list(meters)
+        daily = store.aggregate('day', meters=meters)
+        hourly = store.aggregate('hour', meters=meters)
+        # Meters with readings, in the given order
+        present = set(daily['meter'])
+        rollups = cls.__new__(cls)
+        rollups._build(
+            tuple(meter for meter in meters if meter in present),
+            {quantity: daily.pivot(index='bucket', columns='meter', values=quantity) for quantity in QUANTITIES},
+            store.last_readings(),
+            MeterStore.from_long(hourly, sites=sites)
+        )
+        return rollups
+
+    def _build(self, meters: tuple, frames: Dict[str, pd.DataFrame], last_reading: dict, hourly: MeterStore):
+        self.meters = meters
+        # Date of the newest reading of each meter
+        self.last_reading = {meter: ts for meter, ts in last_reading.items() if meter in meters}
+        frames = {quantity: self._frame(frame) for quantity, frame in frames.items()}
+
+        frame = frames['energy']
+        self.hourly = hourly
+        self.daily = frame.resample('D').sum().astype(np.float32)
+        self.monthly = frame.resample('MS').sum().astype(np.float32)
+        self.origin = self.daily.index[0] if len(self.daily) else None
+
+        self._prefix = {}
+        for quantity, quantity_frame in frames.items():
+            days = quantity_frame.resample('D').sum().to_numpy(float)
+            prefix = np.zeros((len(days) + 1, len(self.meters)))
+            np.cumsum(days, axis=0, out=prefix[1:])
+            # Shared between sessions, so make accidental writes fail loudly
+            prefix.setflags(write=False)
+            self._prefix[quantity] = prefix
+        self._columns = {name: i for i, name in enumerate(self.meters)}
+
+    def _frame(self, frame: pd.DataFrame) -> pd.DataFrame:
+        frame = frame.reindex(columns=list(self.meters))
+        if not isinstance(frame.index, pd.DatetimeIndex):
+            # No readings at all
+            frame.index = pd.DatetimeIndex([])
+        return frame.sort_index().astype(float).fillna(0.0)
+
+    def _day_index(self, day) -> int:
+        """Position of `day` on the day grid, clipped to the grid"""
+        index = (pd.Timestamp(day).normalize() - self.origin).days
+        return min(max(index, 0), len(self._prefix['energy']) - 1)
+
+    def meter_totals(self, start, end, quantity: str = 'energy') -> np.ndarray:
+        """Consumption (or its cost/co2) per meter from start to end, whole days, both included"""
+        if self.origin is None:
+            return np.zeros(len(self.meters))
+        first = self._day_index(start)
+        stop = self._day_index(pd.Timestamp(end) + pd.Timedelta(days=1))
+        if stop <= first:
+            return np.zeros(len(self.meters))
+        prefix = self._prefix[quantity]
+        return prefix[stop] - prefix[first]
+
+    def meter_total(self, meter: str, quantity: str = 'energy') -> float:
+        """Consumption of a meter over the whole history, 0 for unknown meters"""
+        if meter not in self._columns:
+            return 0.0
+        return float(self._prefix[quantity][-1, self._columns[meter]])
+
+    def total(self, start, end, meters: Optional[Iterable[str]] = None, quantity: str = 'energy') -> float:
+        """Consumption (or its cost/co2) of the given (default: all) meters from start to end"""
+        totals = self.meter_totals(start, end, quantity)
+        if meters is None:
+            return float(totals.sum())
+        return float(sum(totals[self._columns[m]] for m in meters if m in self._columns))
+
+
+def _source_version(name: str, tariff_hashes: list) -> str:
+    """Version of a source's import: its workbook, its meters and the tariffs they were priced with"""
+    path = EXCEL_PATHS[name]
+    digest = hashlib.sha256()
+    for part in (content_hash(path) if os.path.exists(path) else 'missing', repr(REGISTRY.meters_of(name)),
+                 *tariff_hashes):
+        digest.update(part.encode())
+    return digest.hexdigest()
+
+
+def import_history(store: StorageBackend):
+    """Import the priced readings of the sources that changed since their last import.
+
+    A source that fails to load keeps its previous import.
+    """
+    tariff_hashes = [content_hash(path) for path in tariff_files(REGISTRY) if os.path.exists(path)]
+    versions = {name: _source_version(name, tariff_hashes) for name in REGISTRY.sources}
+    stale = [name for name, version in versions.items() if store.source_version(name) != version]
+    if not stale:
+        return
+
+    history = load_meter_history()
+    carriers = {meter.key: meter.carrier for meter in REGISTRY.meters.values()}
+    priced = price_series(history.series, load_tariffs(REGISTRY), carriers)
+    for name in stale:
+        if name in history.errors:
+            continue
+        meters = [meter.key for meter in REGISTRY.meters_of(name)]
+        readings = [
+            pd.DataFrame({'meter': meter, 'ts': priced['energy'][meter].index,
+                          **{quantity: priced[quantity][meter].to_numpy(float) for quantity in QUANTITIES}})
+            for meter in meters if meter in priced['energy']
+        ]
+        readings = pd.concat(readings, ignore_index=True) if readings else pd.DataFrame(
+            columns=['meter', 'ts', *QUANTITIES]
+        )
+        logger.info("Importing %d readings of %s", len(readings), name)
+        store.replace_source(name, versions[name], meters, readings)
+
+
+# One import at a time, whoever needs the stored history first does it
+_import_lock = threading.Lock()
+
+
+def stored_history() -> StorageBackend:
+    """The storage backend, with the workbooks that changed since their last import imported"""
+    store = get_storage()
+    with _import_lock:
+        import_history(store)
+    return store
+
+
+def history_key() -> tuple:
+    """Content hashes of the workbooks and tariff tables the stored history is made of"""
+    return tuple(
+        content_hash(path) if os.path.exists(path) else None
+        for path in [*EXCEL_PATHS.values(), *tariff_files(REGISTRY)]
+    )
+
+
+# Rollups of the current workbook contents, rebuilt when one of them changes
+_cache = {'key': None, 'rollups': None}
+_cache_lock = threading.Lock()
+
+
+def load_rollups() -> MeterRollups:
+    """MeterRollups of the meter workbooks and tariff tables; unchanged files return the same object.
+
+    Changed workbooks are imported into the storage backend first, the
+    rollups are then built from the sums it aggregates.
+    """
+    key = history_key()
+    with _cache_lock:
+        count_cache('rollups', hit=key == _cache['key'])
+        if key != _cache['key']:
+            store = stored_history()
+            rollups = MeterRollups.from_store(
+                store, list(REGISTRY.meters), {meter.key: meter.site for meter in REGISTRY.meters.values()}
+            )
+            # Memory-mapped instead if it doesn't fit ENERGYBOARD_MEMORY_BUDGET_MB
+            rollups.hourly = memory_budget.admit('rollups_hourly', rollups.hourly)
+            _cache['rollups'] = rollups
+            _cache['key'] = key
+            for meter, last_reading in _cache['rollups'].last_reading.items():
+                set_data_age(meter, last_reading)
+        return _cache['rollups']
+
+
+def _period_values(rollups: MeterRollups, start, end) -> dict:
+    return {
+        'energy': rollups.total(start, end),
+        'co2': rollups.total(start, end, quantity='co2'),
+        'cost': rollups.total(start, end, quantity='cost')
+    }
+
+
+def get_kpi_values(rollups: MeterRollups, time_selection) -> dict:
+    """Energy, CO2 and cost of a range (tuple) or a single date.
+
+    The deltas compare with the period of the same length right before.
+    """
+    if isinstance(time_selection, tuple):
+        start, end = time_selection
+    else:
+        start = end = time_selection
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+
+    length = end.normalize() - start.normalize() + datetime.timedelta(days=1)
+    current = _period_values(rollups, start, end)
+    previous = _period_values(rollups, start - length, end - length)
+
+    kpis = {}
+    for name, value in current.items():
+        kpis[name] = round(value)
+        kpis[f'{name}_delta'] = round(value - previous[name])
+    return kpis
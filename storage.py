@@ -0,0 +1,277 @@
+"""Storage of the meter readings with the aggregations done by the database.
+
+The workbooks stay the source of the readings, but they are imported once
+per change into a StorageBackend, together with the cost and CO2 of every
+reading. The dashboard asks the backend for aggregates: range filters,
+sum/avg and the grouping by hour/day/month run in the database and only
+the aggregated rows reach pandas. Only the timeline pyramids (pyramid.py)
+read the readings themselves, once per import.
+
+ENERGYBOARD_STORAGE selects the backend:
+
+- a path (default .cache/energyboard.sqlite): an embedded SQLite file
+- 'snowflake': the warehouse, connected with the SNOWFLAKE_* variables
+"""
+import abc
+import contextlib
+import functools
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, Optional, Sequence
+
+import pandas as pd
+
+STORAGE = os.environ.get('ENERGYBOARD_STORAGE', os.path.join('.cache', 'energyboard.sqlite'))
+
+# Aggregated columns of the readings
+QUANTITIES = ('energy', 'cost', 'co2')
+BUCKETS = ('hour', 'day', 'month')
+AGGREGATES = ('sum', 'avg', 'min', 'max')
+
+
+class StorageBackend(abc.ABC):
+    """Readings per meter: (ts, energy kWh, cost €, co2 kg) rows"""
+
+    @abc.abstractmethod
+    def source_version(self, source: str) -> Optional[str]:
+        """Version stored with the last import of a source, None if never imported"""
+
+    @abc.abstractmethod
+    def replace_source(self, source: str, version: str, meters: Sequence[str], readings: pd.DataFrame):
+        """Replace the readings of `meters` by `readings` (columns meter, ts and QUANTITIES)"""
+
+    @abc.abstractmethod
+    def aggregate(self, bucket: Optional[str] = None, start=None, end=None,
+                  meters: Optional[Iterable[str]] = None, how: str = 'sum') -> pd.DataFrame:
+        """Aggregated QUANTITIES per meter (and per bucket) of the readings in [start, end).
+
+        Columns: meter, bucket (unless bucket is None) and QUANTITIES.
+        """
+
+    @abc.abstractmethod
+    def readings(self, start=None, end=None, meters: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """The stored readings in [start, end), columns meter, ts and QUANTITIES, by meter then time"""
+
+    @abc.abstractmethod
+    def last_readings(self) -> Dict[str, pd.Timestamp]:
+        """Time of the newest reading of each meter"""
+
+
+def _bounds(start, end):
+    return (None if start is None else pd.Timestamp(start),
+            None if end is None else pd.Timestamp(end))
+
+
+class SqlBackend(StorageBackend):
+    """The SQL shared by the backends, only bucketing and parameters differ"""
+
+    placeholder = '?'
+
+    @abc.abstractmethod
+    def _connect(self):
+        """A DB-API connection used as context manager committing on success"""
+
+    @abc.abstractmethod
+    def _bucket(self, bucket: str) -> str:
+        """SQL expression truncating `ts` to the start of its bucket"""
+
+    def _ts(self, timestamp: pd.Timestamp):
+        """Parameter value of a timestamp"""
+        return timestamp.to_pydatetime()
+
+    def _frame(self, rows, columns) -> pd.DataFrame:
+        frame = pd.DataFrame.from_records(rows, columns=columns)
+        for column in ('bucket', 'ts'):
+            if column in frame:
+                frame[column] = pd.to_datetime(frame[column])
+        return frame
+
+    def source_version(self, source):
+        with self._connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute(f"SELECT version FROM sources WHERE name = {self.placeholder}", (source,))
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def replace_source(self, source, version, meters, readings):
+        p = self.placeholder
+        rows = list(zip(
+            readings['meter'].astype(str),
+            (self._ts(ts) for ts in pd.DatetimeIndex(readings['ts'])),
+            *(readings[quantity].astype(float) for quantity in QUANTITIES)
+        ))
+        with self._connect() as connection:
+            cursor = connection.cursor()
+            if meters:
+                cursor.execute(
+                    f"DELETE FROM readings WHERE meter IN ({', '.join([p] * len(meters))})", tuple(meters)
+                )
+            if rows:
+                cursor.executemany(
+                    f"INSERT INTO readings (meter, ts, {', '.join(QUANTITIES)}) VALUES ({', '.join([p] * 5)})", rows
+                )
+            cursor.execute(f"DELETE FROM sources WHERE name = {p}", (source,))
+            cursor.execute(f"INSERT INTO sources (name, version) VALUES ({p}, {p})", (source, version))
+
+    def aggregate(self, bucket=None, start=None, end=None, meters=None, how='sum'):
+        if bucket is not None and bucket not in BUCKETS:
+            raise ValueError(f"Unknown bucket {bucket!r}, expected one of {', '.join(BUCKETS)}")
+        if how not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate {how!r}, expected one of {', '.join(AGGREGATES)}")
+        columns = ['meter'] + (['bucket'] if bucket else []) + list(QUANTITIES)
+        where, params = self._where(start, end, meters)
+        if where is None:
+            return self._frame([], columns)
+
+        keys = ['meter'] if bucket is None else ['meter', f"{self._bucket(bucket)} AS bucket"]
+        groups = 'meter' if bucket is None else 'meter, bucket'
+        sql = (
+            f"SELECT {', '.join(keys)}, {', '.join(f'{how.upper()}({q}) AS {q}' for q in QUANTITIES)} "
+            f"FROM readings {where} GROUP BY {groups} ORDER BY {groups}"
+        )
+        return self._frame(self._fetch(sql, params), columns)
+
+    def readings(self, start=None, end=None, meters=None):
+        columns = ['meter', 'ts', *QUANTITIES]
+        where, params = self._where(start, end, meters)
+        if where is None:
+            return self._frame([], columns)
+        sql = f"SELECT {', '.join(columns)} FROM readings {where} ORDER BY meter, ts"
+        return self._frame(self._fetch(sql, params), columns)
+
+    def _where(self, start, end, meters):
+        """(WHERE clause, parameters) of a range and meters; clause None if no meter is asked for"""
+        p = self.placeholder
+        where, params = [], []
+        start, end = _bounds(start, end)
+        if start is not None:
+            where.append(f"ts >= {p}")
+            params.append(self._ts(start))
+        if end is not None:
+            where.append(f"ts < {p}")
+            params.append(self._ts(end))
+        if meters is not None:
+            meters = list(meters)
+            if not meters:
+                return None, []
+            where.append(f"meter IN ({', '.join([p] * len(meters))})")
+            params.extend(meters)
+        return ('WHERE ' + ' AND '.join(where) if where else ''), params
+
+    def _fetch(self, sql: str, params) -> list:
+        with self._connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute(sql, tuple(params))
+            return cursor.fetchall()
+
+    def last_readings(self):
+        with self._connect() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT meter, MAX(ts) FROM readings GROUP BY meter")
+            rows = cursor.fetchall()
+        return {meter: pd.Timestamp(ts) for meter, ts in rows}
+
+
+class SQLiteBackend(SqlBackend):
+    """Embedded backend in a single SQLite file.
+
+    Timestamps are stored as ISO text ('YYYY-MM-DD HH:MM:SS'), which sorts
+    and compares chronologically and which SQLite's date functions bucket.
+    A connection is opened per operation, so any thread can use the backend.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS readings ("
+        " meter TEXT NOT NULL, ts TEXT NOT NULL, energy REAL NOT NULL, cost REAL NOT NULL, co2 REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS readings_meter_ts ON readings (meter, ts)",
+        "CREATE TABLE IF NOT EXISTS sources (name TEXT PRIMARY KEY, version TEXT NOT NULL)",
+    )
+    BUCKETS = {
+        'hour': "strftime('%Y-%m-%d %H:00:00', ts)",
+        'day': "date(ts)",
+        'month': "date(ts, 'start of month')",
+    }
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Writes of imports are serialised, reads run concurrently (WAL)
+        self._write_lock = threading.Lock()
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _bucket(self, bucket):
+        return self.BUCKETS[bucket]
+
+    def _ts(self, timestamp):
+        return timestamp.strftime('%Y-%m-%d %H:%M:%S')
+
+    def replace_source(self, source, version, meters, readings):
+        with self._write_lock:
+            super().replace_source(source, version, meters, readings)
+
+
+class SnowflakeBackend(SqlBackend):
+    """Warehouse backend with the same tables, created by the deployment:
+
+        CREATE TABLE readings (meter VARCHAR, ts TIMESTAMP_NTZ, energy FLOAT, cost FLOAT, co2 FLOAT)
+            CLUSTER BY (meter, ts);
+        CREATE TABLE sources (name VARCHAR PRIMARY KEY, version VARCHAR);
+
+    The connection settings are the keyword arguments of
+    snowflake.connector.connect, by default read from SNOWFLAKE_ACCOUNT,
+    SNOWFLAKE_USER, SNOWFLAKE_PASSWORD, SNOWFLAKE_WAREHOUSE,
+    SNOWFLAKE_DATABASE and SNOWFLAKE_SCHEMA.
+    """
+
+    placeholder = '%s'
+    BUCKETS = {'hour': "DATE_TRUNC('HOUR', ts)", 'day': "DATE_TRUNC('DAY', ts)", 'month': "DATE_TRUNC('MONTH', ts)"}
+    SETTINGS = ('account', 'user', 'password', 'warehouse', 'database', 'schema')
+
+    def __init__(self, **settings):
+        # Only needed for this backend
+        import snowflake.connector
+
+        self._connector = snowflake.connector
+        self.settings = settings or {
+            name: os.environ[f'SNOWFLAKE_{name.upper()}']
+            for name in self.SETTINGS if f'SNOWFLAKE_{name.upper()}' in os.environ
+        }
+
+    @contextlib.contextmanager
+    def _connect(self):
+        connection = self._connector.connect(**self.settings)
+        try:
+            yield connection
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+    def _bucket(self, bucket):
+        return self.BUCKETS[bucket]
+
+
+@functools.lru_cache(maxsize=None)
+def get_storage(storage: str = STORAGE) -> StorageBackend:
+    """The backend of `storage` (see ENERGYBOARD_STORAGE), one per process"""
+    if storage == 'snowflake':
+        return SnowflakeBackend()
+    return SQLiteBackend(storage)
+
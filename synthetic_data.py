@@ -0,0 +1,358 @@
+"""Realistic synthetic meter series for load tests.
+
+Generates multi-year interval readings (kWh per interval) for any number of
+sites, chunk by chunk, so even 100M rows never have to fit in memory:
+
+- electricity: working-day load shape, weekends at base load
+- pv: generation curve following the season's day length, cloudy days
+- gas: heating that follows the outside temperature, plus hot water
+- gaps (empty readings while a logger is offline) and meter counter resets
+  (one large negative reading, as computed from a cumulative counter)
+
+The chunks can be written as the E_H.xlsx/E_P.xlsx workbooks read by
+excel_reader (with a sites.toml for ENERGYBOARD_SITES), as the api/db.json
+served to EnergyAPI, or as Parquet:
+
+    python synthetic_data.py --years 3 --format xlsx --output data/
+    python synthetic_data.py --years 10 --extra-sites 50 --format parquet --output data/
+"""
+import argparse
+import datetime
+import json
+import os
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import toml
+from faker import Faker
+
+from excel_reader import EXCEL_PATHS, METER_COLUMNS, REGISTRY
+from registry import REGISTRY_PATH, _read_toml
+
+# Most rows an Excel sheet can hold
+EXCEL_MAX_ROWS = 1_048_576
+
+# Title rows written above the data, as in the real workbooks
+TITLE_ROWS = 2
+
+
+class MeterProfile(NamedTuple):
+    """Shape of one meter's readings"""
+    name: str
+    kind: str  # 'electricity', 'pv' or 'gas'
+    scale_kw: float  # Typical (base load/peak/heating) power
+    site: str = ''
+    serial: str = ''
+
+
+# Meters of the workbooks (excel_reader.METER_COLUMNS) and of the API
+DEFAULT_METERS = (
+    MeterProfile('hiltrup_energy', 'electricity', 40.0, 'Hiltrup'),
+    MeterProfile('hiltrup_gas', 'gas', 120.0, 'Hiltrup'),
+    MeterProfile('prefab_energy', 'electricity', 25.0, 'Prefab'),
+    MeterProfile('prefab_gas', 'gas', 60.0, 'Prefab'),
+    MeterProfile('Halloeins', 'electricity', 100.0, 'Halle 1'),
+    MeterProfile('Hallozwei', 'electricity', 90.0, 'Halle 2'),
+    MeterProfile('Hallodrei', 'pv', 80.0, 'Halle 3'),
+)
+
+
+def make_meters(extra_sites: int = 0, seed: int = 0) -> List[MeterProfile]:
+    """The default meters plus `extra_sites` made-up sites with one meter of each kind"""
+    fake = Faker('de_DE')
+    fake.seed_instance(seed)
+    rng = np.random.default_rng(seed)
+
+    meters = [meter._replace(serial=fake.unique.bothify('1EMH-####-????').upper()) for meter in DEFAULT_METERS]
+    for _ in range(extra_sites):
+        site = fake.unique.city()
+        slug = ''.join(c for c in site.lower() if c.isalnum())
+        for kind, scale in (('electricity', 40.0), ('pv', 50.0), ('gas', 100.0)):
+            meters.append(MeterProfile(
+                f'{slug}_{kind}', kind, float(scale * rng.uniform(0.3, 3.0)), site,
+                fake.unique.bothify('1EMH-####-????').upper()
+            ))
+    return meters
+
+
+class SeriesGenerator:
+    """Chunks of synthetic readings: a 'timestamp' column and one column per meter.
+
+    Everything random that spans more than one interval (daily weather, gaps,
+    counter resets) is drawn up front per day or per event, so only the
+    interval noise depends on the chunk size.
+    """
+
+    def __init__(self, meters: Iterable[MeterProfile] = DEFAULT_METERS, start='2020-01-01',
+                 periods: Optional[int] = None, end=None, freq='15min', seed: int = 0,
+                 gap_rate: float = 2.0, reset_rate: float = 0.2):
+        """periods or end: length of the series.
+
+        gap_rate: logger outages per meter and year, reset_rate: counter resets per meter and year.
+        """
+        self.meters = list(meters)
+        self.start = pd.Timestamp(start)
+        self.freq = pd.Timedelta(freq)
+        if periods is None:
+            if end is None:
+                raise ValueError("Either periods or end is required")
+            periods = int((pd.Timestamp(end) - self.start) // self.freq)
+        self.periods = int(periods)
+        self.seed = seed
+
+        rng = np.random.default_rng(seed)
+        days = int((self.start + self.periods * self.freq - self.start.normalize()) // pd.Timedelta('1D')) + 1
+        per_year = pd.Timedelta('365D') / self.freq
+
+        # Outside temperature per day: seasonal curve plus weather
+        day_of_year = (self.start.normalize() + pd.to_timedelta(np.arange(days), 'D')).dayofyear.to_numpy()
+        weather = np.convolve(rng.normal(0, 3, days + 6), np.ones(7) / 7, mode='valid')[:days]
+        self._temperature = 10 - 9 * np.cos(2 * np.pi * (day_of_year - 20) / 365.25) + weather
+
+        self._daily = {}  # meter -> per-day factor (cloudiness, activity)
+        self._gaps = {}  # meter -> (sorted gap starts, gap ends) in intervals
+        self._resets = {}  # meter -> sorted reset positions in intervals
+        for meter in self.meters:
+            if meter.kind == 'pv':
+                self._daily[meter.name] = rng.beta(4, 1.5, days)
+            else:
+                self._daily[meter.name] = rng.lognormal(0, 0.08, days)
+
+            gap_starts = np.sort(rng.integers(0, self.periods, rng.poisson(gap_rate * self.periods / per_year)))
+            # Logger outages, six hours on average
+            gap_lengths = np.ceil(rng.exponential(pd.Timedelta('6h') / self.freq, len(gap_starts))).astype(np.int64)
+            self._gaps[meter.name] = (gap_starts, gap_starts + gap_lengths)
+            self._resets[meter.name] = np.sort(rng.integers(
+                0, self.periods, rng.poisson(reset_rate * self.periods / per_year)
+            ))
+
+        # Counter reading of each meter at the end of the previous chunk
+        self._counters = dict.fromkeys((meter.name for meter in self.meters), 0.0)
+
+    def chunks(self, chunk_rows: int = 100_000) -> Iterator[pd.DataFrame]:
+        """The whole series, `chunk_rows` intervals at a time"""
+        self._counters = dict.fromkeys(self._counters, 0.0)
+        rng = np.random.default_rng([self.seed, 1])
+        for first in range(0, self.periods, chunk_rows):
+            yield self._chunk(first, min(first + chunk_rows, self.periods), rng)
+
+    def _chunk(self, first: int, stop: int, rng) -> pd.DataFrame:
+        positions = np.arange(first, stop)
+        timestamps = pd.date_range(self.start + first * self.freq, periods=stop - first, freq=self.freq)
+        day = np.asarray((timestamps - self.start.normalize()).days)
+        hour = np.asarray(timestamps.hour + timestamps.minute / 60)
+        day_of_year = np.asarray(timestamps.dayofyear)
+        workday = np.asarray(timestamps.dayofweek < 5)
+        hours = self.freq / pd.Timedelta('1h')
+
+        columns = {'timestamp': timestamps}
+        for meter in self.meters:
+            if meter.kind == 'electricity':
+                # Base load at night and on weekends, production shifts on workdays
+                shift = np.clip(np.sin(np.pi * (hour - 5) / 14), 0, None) * workday
+                power = meter.scale_kw * (0.35 + 0.65 * shift ** 0.5)
+                power *= self._daily[meter.name][day] * rng.lognormal(0, 0.05, len(positions))
+            elif meter.kind == 'pv':
+                # Sun between sunrise and sunset, days are longer in summer
+                day_length = 12 - 4 * np.cos(2 * np.pi * (day_of_year + 10) / 365.25)
+                sunrise = 12.5 - day_length / 2
+                sun = np.clip(np.sin(np.pi * (hour - sunrise) / day_length), 0, None)
+                height = 0.55 - 0.45 * np.cos(2 * np.pi * (day_of_year + 10) / 365.25)
+                power = meter.scale_kw * sun * height * self._daily[meter.name][day]
+                power *= rng.uniform(0.85, 1.0, len(positions))
+            elif meter.kind == 'gas':
+                # Heating below 15 degrees, stronger in the morning, plus hot water
+                heating = np.clip(15 - self._temperature[day], 0, None) / 15
+                morning = 1 + 0.4 * np.exp(-((hour - 7) ** 2) / 4)
+                power = meter.scale_kw * (0.08 + heating * morning * np.where(workday, 1.0, 0.7))
+                power *= self._daily[meter.name][day] * rng.lognormal(0, 0.1, len(positions))
+            else:
+                raise ValueError(f"Unknown meter kind: {meter.kind}")
+
+            values = power * hours
+            self._add_resets(meter.name, first, stop, values)
+            self._add_gaps(meter.name, first, stop, values)
+            columns[meter.name] = values
+
+        return pd.DataFrame(columns)
+
+    def _add_resets(self, name, first, stop, values):
+        """A reset shows as its interval's energy minus the counter reading before it"""
+        resets = self._resets[name]
+        # Energy counted since the last reset, up to the rows from `last` on
+        counter = self._counters[name]
+        last = 0
+        for position in resets[np.searchsorted(resets, first):np.searchsorted(resets, stop)]:
+            i = position - first
+            counter += values[last:i].sum()
+            energy = values[i]
+            values[i] = energy - counter
+            # The counter restarts at zero, so it holds this interval's energy
+            counter = energy
+            last = i + 1
+        self._counters[name] = counter + values[last:].sum()
+
+    def _add_gaps(self, name, first, stop, values):
+        gap_starts, gap_ends = self._gaps[name]
+        # Gaps that started before this chunk and may still be running
+        for gap_start, gap_end in zip(gap_starts[:np.searchsorted(gap_starts, stop)],
+                                      gap_ends[:np.searchsorted(gap_starts, stop)]):
+            if gap_end > first:
+                values[max(gap_start, first) - first:min(gap_end, stop) - first] = np.nan
+
+
+def write_registry(directory: str, paths: Dict[str, str]) -> str:
+    """Write a copy of sites.toml into `directory` that reads the workbooks `paths`.
+
+    Point ENERGYBOARD_SITES at it to run the dashboard on generated data;
+    the tariff tables stay those of the real registry.
+    """
+    config = _read_toml(REGISTRY_PATH)
+    for name, path in paths.items():
+        config['sources'][name]['path'] = os.path.relpath(path, directory)
+    for name, carrier in REGISTRY.carriers.items():
+        config['carriers'][name] = {table: getattr(carrier, table) for table in ('price', 'co2')
+                                    if getattr(carrier, table)}
+    path = os.path.join(directory, 'sites.toml')
+    with open(path, 'w', encoding='utf-8') as f:
+        toml.dump(config, f)
+    return path
+
+
+def write_workbooks(directory: str, chunks: Iterable[pd.DataFrame]) -> Dict[str, str]:
+    """Write the chunks as E_H.xlsx/E_P.xlsx in the layout of excel_reader.METER_COLUMNS.
+
+    Returns {workbook: path}. The chunks need the meters of METER_COLUMNS.
+    A sites.toml reading them is written next to them (write_registry).
+    """
+    import openpyxl
+
+    os.makedirs(directory, exist_ok=True)
+    books, sheets, widths = {}, {}, {}
+    for workbook in EXCEL_PATHS:
+        meters = {meter: columns[1:] for meter, columns in METER_COLUMNS.items() if columns[0] == workbook}
+        books[workbook] = openpyxl.Workbook(write_only=True)
+        sheets[workbook] = books[workbook].create_sheet('Fest')
+        widths[workbook] = max(max(columns) for columns in meters.values()) + 1
+
+        title = [None] * widths[workbook]
+        header = [None] * widths[workbook]
+        for meter, (date_column, value_column) in meters.items():
+            title[date_column] = meter
+            header[date_column] = 'Datum'
+            header[value_column] = 'Energiemenge (kWh)'
+        sheets[workbook].append(title)
+        sheets[workbook].append(header)
+
+    rows = TITLE_ROWS
+    for chunk in chunks:
+        rows += len(chunk)
+        if rows > EXCEL_MAX_ROWS:
+            raise ValueError(f"Excel sheets hold at most {EXCEL_MAX_ROWS} rows, write Parquet instead")
+        timestamps = pd.DatetimeIndex(chunk['timestamp']).to_pydatetime()
+        for workbook, sheet in sheets.items():
+            columns = [(date_column, value_column, chunk[meter].to_numpy())
+                       for meter, (book, date_column, value_column) in METER_COLUMNS.items() if book == workbook]
+            for i, timestamp in enumerate(timestamps):
+                row = [None] * widths[workbook]
+                for date_column, value_column, values in columns:
+                    row[date_column] = timestamp
+                    # Gaps are empty cells
+                    row[value_column] = None if np.isnan(values[i]) else float(values[i])
+                sheet.append(row)
+
+    paths = {}
+    for workbook, path in EXCEL_PATHS.items():
+        # The registry's paths are absolute, only the file name is kept
+        paths[workbook] = os.path.join(directory, os.path.basename(path))
+        books[workbook].save(paths[workbook])
+    write_registry(directory, paths)
+    return paths
+
+
+def write_energy_data_json(path: str, chunks: Iterable[pd.DataFrame], meters: Optional[List[str]] = None):
+    """Write the chunks in the shape of api/db.json, one energy_data record per row.
+
+    meters: columns to write, default all meters of the chunks.
+    """
+    with open(path, 'w') as f:
+        f.write('{\n  "energy_data": [\n')
+        first_id = 1
+        latest = {}
+        for chunk in chunks:
+            names = meters or [column for column in chunk.columns if column != 'timestamp']
+            records = chunk[names].copy()
+            records.insert(0, 'timestamp', np.datetime_as_string(chunk['timestamp'].to_numpy(), unit='s'))
+            records.insert(0, 'id', np.arange(first_id, first_id + len(chunk)).astype(str))
+            if first_id > 1:
+                f.write(',\n')
+            # One record per line; the C encoder, NaN (a gap) becomes null
+            f.write(records.to_json(orient='records', lines=True, double_precision=3).rstrip('\n').replace('\n', ',\n'))
+            first_id += len(chunk)
+            latest = {name: float(value) for name, value in chunk[names].ffill().iloc[-1].items()}
+        f.write('\n  ],\n  "latest_readings": ')
+        f.write(json.dumps(latest))
+        f.write('\n}\n')
+
+
+def write_parquet(path: str, chunks: Iterable[pd.DataFrame], meters: Optional[List[MeterProfile]] = None):
+    """Write the chunks to one Parquet file, a row group per chunk.
+
+    The meters' kind, site and serial are kept in the file's metadata.
+    """
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                schema = table.schema
+                if meters:
+                    schema = schema.with_metadata({
+                        **(schema.metadata or {}),
+                        b'energyboard.meters': json.dumps([meter._asdict() for meter in meters]).encode()
+                    })
+                writer = pq.ParquetWriter(path, schema, compression='zstd')
+            writer.write_table(table.replace_schema_metadata(writer.schema.metadata))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--start', default='2020-01-01')
+    parser.add_argument('--years', type=float, default=3)
+    parser.add_argument('--periods', type=int, help='number of intervals, instead of --years')
+    parser.add_argument('--freq', default='15min')
+    parser.add_argument('--extra-sites', type=int, default=0, help='made-up sites on top of the default meters')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-rows', type=int, default=100_000)
+    parser.add_argument('--format', choices=('xlsx', 'json', 'parquet'), default='parquet')
+    parser.add_argument('--output', default='.', help='output directory')
+    args = parser.parse_args()
+
+    meters = make_meters(args.extra_sites, args.seed)
+    start = pd.Timestamp(args.start)
+    end = None if args.periods else start + pd.DateOffset(days=round(args.years * 365.25))
+    generator = SeriesGenerator(meters, start, periods=args.periods, end=end, freq=args.freq, seed=args.seed)
+    chunks = generator.chunks(args.chunk_rows)
+
+    os.makedirs(args.output, exist_ok=True)
+    started = datetime.datetime.now()
+    if args.format == 'xlsx':
+        written = [*write_workbooks(args.output, chunks).values(), os.path.join(args.output, 'sites.toml')]
+    elif args.format == 'json':
+        written = [os.path.join(args.output, 'db.json')]
+        write_energy_data_json(written[0], chunks)
+    else:
+        written = [os.path.join(args.output, 'meters.parquet')]
+        write_parquet(written[0], chunks, meters)
+    print(f"{generator.periods} intervals x {len(meters)} meters -> {', '.join(written)} "
+          f"in {(datetime.datetime.now() - started).total_seconds():.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Time-varying prices and emission factors per energy carrier.
+
+Each carrier (electricity, gas) has a price table (€/kWh) and an emission
+table (kg CO2/kWh), CSV files with `valid_from,rate` rows as configured in
+sites.toml. A rate applies from its timestamp until the next one, so
+monthly and hourly tables are both just step functions. Looking up the
+rates of a whole series is one np.searchsorted.
+"""
+import os
+from typing import Dict, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+from registry import Registry
+
+# Rates used when a carrier has no table: the 'Co2-emis' factor of the
+# workbooks and the price used until real tariffs are available
+CO2_KG_PER_KWH = 0.352
+PRICE_EUR_PER_KWH = 0.30
+
+
+class RateTable(NamedTuple):
+    """Step function: rates[i] applies from valid_from[i] until valid_from[i + 1]"""
+    valid_from: np.ndarray  # datetime64[ns], sorted
+    rates: np.ndarray  # float
+
+    @classmethod
+    def constant(cls, rate: float) -> 'RateTable':
+        return cls(np.array([], dtype='datetime64[ns]'), np.array([rate], dtype=float))
+
+    def at(self, times) -> np.ndarray:
+        """Rate at each of `times`; times before the first row get the first rate"""
+        if len(self.valid_from) == 0:
+            return np.full(len(times), self.rates[0])
+        positions = np.searchsorted(self.valid_from, np.asarray(times, dtype='datetime64[ns]'), side='right') - 1
+        return self.rates[np.clip(positions, 0, None)]
+
+
+def load_rate_table(path: str, default: float) -> RateTable:
+    """The table of a `valid_from,rate` CSV file, a constant `default` if there is none"""
+    if not path or not os.path.exists(path):
+        return RateTable.constant(default)
+    df = pd.read_csv(path, comment='#', skipinitialspace=True)
+    if df.empty:
+        return RateTable.constant(default)
+    df['valid_from'] = pd.to_datetime(df['valid_from'])
+    df = df.sort_values('valid_from', kind='stable')
+    return RateTable(df['valid_from'].to_numpy('datetime64[ns]'), df['rate'].to_numpy(float))
+
+
+class Tariffs(NamedTuple):
+    prices: Dict[str, RateTable]  # carrier -> €/kWh
+    emissions: Dict[str, RateTable]  # carrier -> kg CO2/kWh
+
+    def price(self, carrier: str) -> RateTable:
+        return self.prices.get(carrier) or RateTable.constant(PRICE_EUR_PER_KWH)
+
+    def emission(self, carrier: str) -> RateTable:
+        return self.emissions.get(carrier) or RateTable.constant(CO2_KG_PER_KWH)
+
+    def apply(self, series: pd.Series, carrier: str):
+        """(cost, co2) of each interval of a consumption series indexed by time"""
+        values = series.to_numpy(float)
+        cost = values * self.price(carrier).at(series.index)
+        co2 = values * self.emission(carrier).at(series.index)
+        return pd.Series(cost, index=series.index), pd.Series(co2, index=series.index)
+
+
+def tariff_files(registry: Registry):
+    """Paths of all configured tables, for cache keys"""
+    return [path for carrier in registry.carriers.values() for path in (carrier.price, carrier.co2) if path]
+
+
+def load_tariffs(registry: Registry) -> Tariffs:
+    return Tariffs(
+        {name: load_rate_table(carrier.price, PRICE_EUR_PER_KWH) for name, carrier in registry.carriers.items()},
+        {name: load_rate_table(carrier.co2, CO2_KG_PER_KWH) for name, carrier in registry.carriers.items()}
+    )